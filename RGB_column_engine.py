@@ -0,0 +1,255 @@
+'''
+One engine for the (300,1,3) 8-bit RGB-columns made out of the averaged spectrograms, replacing the four column makers
+(RGB_column_maker.py, normalised_RGB_column_maker.py, past-RGB-column-maker.py, past-normalised-RGB-column-maker.py,
+now thin wrappers). A column profile holds what differed between them: emission rows, spatial range and scaling. The rows
+of the live profile come from the wavelength calibration (spectral_calibration.csv).
+
+The RGB-columns of a day are written into one daily column store (column_store.RGBColumnStore: a pre-sized memory map with a
+per-minute presence mask, read by the keogram makers with a single slice) instead of 1440 PNG files; the PNG columns can
+still be made with png_columns (--png-columns).
+
+With a line column folder, every spectrogram also gives a multi-channel column product: the intensity of every band of the
+calibration table along the spatial axis (float32, background subtracted, spectral_calibration.py), written in place into
+the daily (bands x spatial pixels x 1440 minutes) memory-mapped store of column_store.py.
+
+With an emission index, the mean and maximum of each emission line over the spatial range and zenith-angle bands are also
+written per minute into the SQLite index of emission_index.py, to search for events over a season.
+
+Two run modes:
+- live: each averaged spectrogram is turned into a column as soon as average_PNG_maker.py has completed it (delivered by
+  averaged_frame_watcher.py, which checkpoints the processed minutes and rolls over at UTC midnight)
+- backfill: all the days of a date range, each day in one batched pass (emission_line_extraction.py), days spread over
+  a process pool. Reprocessing a season with a new calibration is a single command:
+
+    python RGB_column_engine.py --start 2024/01/01 --end 2024/03/31 --profile normalised --overwrite
+
+Nicolas Martinez (UNIS/LTU) 2024
+
+'''
+
+import os
+import time
+import argparse
+import datetime
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+from PIL import Image
+
+from emission_line_extraction import EmissionLineExtractor, rgb_columns, load_reduced, save_rgb_columns, column_filename, scalings
+from spectral_calibration import SpectralExtractor, rows_for
+from column_store import LineIntensityStore, RGBColumnStore
+from averaged_frame_watcher import AveragedFrameWatcher
+from emission_index import EmissionIndex, emission_index_path
+
+
+spectro_path = r'C:\Users\auroras\.venvMISS2\MISS2\Captured_PNG\averaged_PNG' # Directory of the averaged PNG (16-bit) images taken by MISS2
+output_folder_base = r'C:\Users\auroras\.venvMISS2\MISS2\RGB_columns' # Directory where the 8-bit RGB-columns are saved (daily stores)
+line_columns_base = r'C:\Users\auroras\.venvMISS2\MISS2\line_columns' # Directory of the daily stores of the multi-channel (float32) columns
+
+# Rows of the emission lines (630.0, 557.7, 427.8 nm), spatial range (south, north horizon columns, None for the whole width),
+# scaling and vertical binning of the frames of each former column maker
+column_profiles = {
+    # normalised_RGB_column_maker.py: 2x2 binned frames (695x519), rows from the wavelength calibration
+    "normalised": {"rows": rows_for((630.0, 557.7, 427.8), binY=2), "south_column": int(0.18*695), "north_column": int(0.78*695), "scaling": "normalised", "binning": 2},
+    # RGB_column_maker.py: full frames (1391x1039), whole width
+    "full_frame": {"rows": (int(1039 * 0.65), int(1039 * 0.5), int(1039 * 0.35)), "south_column": None, "north_column": None, "scaling": "counts", "binning": 1},
+    # past-RGB-column-maker.py
+    "past": {"rows": (381, 687, 1027), "south_column": None, "north_column": None, "scaling": "counts", "binning": 1},
+    # past-normalised-RGB-column-maker.py
+    "past_normalised": {"rows": (int(1391 * 0.820), int(1391 * 0.480), int(1391 * 0.265)), "south_column": int(0*1391), "north_column": int(0.82*1391), "scaling": "normalised", "binning": 1},
+}
+
+
+class ColumnEngine:
+    # profile: name in column_profiles, factors: red, green, blue gains, scaling: overrides the scaling of the profile
+    # (name in emission_line_extraction.scalings or a function), line_columns_base: directory of the multi-channel columns
+    # (None not to make them), png_columns: also save every RGB-column as a (300,1,3) PNG file, emission_index: SQLite
+    # index of the per-minute line intensities (None not to write it)
+    def __init__(self, profile="normalised", spectro_path=spectro_path, output_folder_base=output_folder_base, factors=(1, 1, 1), scaling=None,
+                 line_columns_base=None, png_columns=False, emission_index=None):
+        settings = column_profiles[profile]
+        self.profile = profile
+        self.spectro_path = spectro_path
+        self.output_folder_base = output_folder_base
+        self.rows = settings["rows"]
+        self.south_column = settings["south_column"]
+        self.north_column = settings["north_column"]
+        self.factors = factors
+        self.scaling = scaling if scaling is not None else settings["scaling"]
+        self.extractor = EmissionLineExtractor(self.rows, self.south_column, self.north_column)
+        self.line_columns_base = line_columns_base
+        self.spectral_extractor = SpectralExtractor(None, self.south_column, self.north_column, settings["binning"]) if line_columns_base else None
+        self.line_store = LineIntensityStore(line_columns_base) if line_columns_base else None
+        self.rgb_store = RGBColumnStore(output_folder_base)
+        self.png_columns = png_columns
+        self.emission_index = EmissionIndex(emission_index) if emission_index else None
+
+        # New averaged spectrograms of the live mode, the processed minutes are checkpointed next to the columns
+        self.watcher = AveragedFrameWatcher(spectro_path, output_folder_base)
+
+    def input_folder(self, date):
+        return os.path.join(self.spectro_path, date.strftime("%Y"), date.strftime("%m"), date.strftime("%d"))
+
+    def output_folder(self, date):
+        return os.path.join(self.output_folder_base, date.strftime("%Y"), date.strftime("%m"), date.strftime("%d"))
+
+    # UTC date and minute of the day of an averaged spectrogram (MISS2-yyyymmdd-hhmmss.png)
+    @staticmethod
+    def spectrogram_minute(png_file_path):
+        filename = os.path.basename(png_file_path)
+        return datetime.date(int(filename[6:10]), int(filename[10:12]), int(filename[12:14])), int(filename[15:17]) * 60 + int(filename[17:19])
+
+    # Minutes of a day that already have an RGB-column in the store
+    def stored_minutes(self, date):
+        day = self.rgb_store.read_day(date)
+        return set() if day is None else set(np.flatnonzero(day[1]).tolist())
+
+    # Write the RGB-columns of the spectrograms into the daily store (and as PNG files if enabled)
+    def store_rgb_columns(self, png_file_paths, columns, output_folder=None):
+        columns_by_day = {}
+        for png_file_path, column in zip(png_file_paths, columns):
+            date, minute = self.spectrogram_minute(png_file_path)
+            columns_by_day.setdefault(date, []).append((minute, column))
+        for date, columns_by_minute in columns_by_day.items():
+            self.rgb_store.write_columns(date, columns_by_minute)
+            if self.png_columns:
+                day_paths = [png_file_path for png_file_path in png_file_paths if self.spectrogram_minute(png_file_path)[0] == date]
+                save_rgb_columns([column for _, column in columns_by_minute], day_paths, output_folder or self.output_folder(date))
+
+    # What is kept of a decoded spectrogram: the bands of the RGB-column, and the intensities of all the calibrated bands
+    def reduce(self, spectro_array):
+        intensities = self.spectral_extractor.extract(spectro_array) if self.spectral_extractor else None
+        return self.extractor.bands(spectro_array), intensities, spectro_array.shape[0]
+
+    # Write the band intensities of the spectrograms into the daily line stores
+    def save_line_columns(self, png_file_paths, reduced_frames):
+        intensities_by_day = {}
+        for png_file_path, (_, intensities, height) in zip(png_file_paths, reduced_frames):
+            date, minute = self.spectrogram_minute(png_file_path)
+            intensities_by_day.setdefault((date, height), []).append((minute, intensities))
+        for (date, height), intensities_by_minute in intensities_by_day.items():
+            self.line_store.write_intensities(date, intensities_by_minute, *self.spectral_extractor.channels(height))
+
+    # Write the line intensities of the spectrograms (profiles from the extractor) into the emission index. Called once the
+    # columns are stored: an error of the index is only logged, it never costs a column
+    def index_emissions(self, png_file_paths, profiles, frame_bands):
+        times = []
+        for png_file_path in png_file_paths:
+            date, minute = self.spectrogram_minute(png_file_path)
+            times.append(datetime.datetime(date.year, date.month, date.day, minute // 60, minute % 60, tzinfo=datetime.timezone.utc))
+        try:
+            self.emission_index.add_minutes(times, profiles, frame_bands)
+        except Exception as e:
+            print(f"Could not index the emission lines of {len(png_file_paths)} spectrograms ({os.path.basename(png_file_paths[0])}...): {e}")
+
+    # Make the RGB-column of one averaged spectrogram (decoded once) and write it into the store of its day, with its
+    # multi-channel column if enabled (output_folder: where the PNG column goes if png_columns). Returns the path of the
+    # store (or of the PNG column), None if the spectrogram is corrupted
+    def make_rgb_column(self, png_file_path, output_folder=None):
+        try:
+            with Image.open(png_file_path) as img:
+                reduced = self.reduce(np.array(img))
+        except Exception as e:
+            print(f"Corrupted raw PNG detected: {png_file_path} - {e}")
+            return None
+
+        if self.spectral_extractor:
+            self.save_line_columns([png_file_path], [reduced])
+        profiles = self.extractor.profiles([reduced[0]])
+        column = rgb_columns(profiles, self.factors, self.scaling)[0]
+        date, _ = self.spectrogram_minute(png_file_path)
+        self.store_rgb_columns([png_file_path], [column], output_folder)
+        if self.emission_index:
+            self.index_emissions([png_file_path], profiles, [reduced[0]])
+        print(f"Saved RGB column: {column_filename(png_file_path)}")
+        if self.png_columns:
+            return os.path.join(output_folder or self.output_folder(date), column_filename(png_file_path))
+        return self.rgb_store.path(date)
+
+    # Make the columns of all the spectrograms of a day in one batched pass. Spectrograms that already have a column are
+    # skipped unless overwrite. Returns the paths of the spectrograms turned into columns.
+    def make_day(self, date, overwrite=False, threads=4):
+        input_folder = self.input_folder(date)
+        try:
+            filenames = sorted(f for f in os.listdir(input_folder) if f.startswith("MISS2-") and f.endswith(".png"))
+        except FileNotFoundError:
+            return []
+        if not overwrite:
+            stored_minutes = self.stored_minutes(date)
+            filenames = [f for f in filenames if self.spectrogram_minute(f)[1] not in stored_minutes]
+        if not filenames:
+            return []
+        reduced_frames, valid_paths = load_reduced([os.path.join(input_folder, f) for f in filenames], self.reduce, threads)
+        if not valid_paths:
+            return []
+        if self.spectral_extractor:
+            self.save_line_columns(valid_paths, reduced_frames)
+        frame_bands = [bands for bands, _, _ in reduced_frames]
+        profiles = self.extractor.profiles(frame_bands)
+        self.store_rgb_columns(valid_paths, rgb_columns(profiles, self.factors, self.scaling))
+        if self.emission_index:
+            self.index_emissions(valid_paths, profiles, frame_bands)
+        print(f"Saved {len(valid_paths)} RGB columns in {self.rgb_store.path(date)}")
+        return valid_paths
+
+    # Live mode: make the columns of the averaged spectrograms completed since the last update. Returns their number.
+    def update_live(self, current_time_UT=None):
+        return self.watcher.deliver(self.make_rgb_column, current_time_UT)
+
+    def run_live(self):
+        self.watcher.run(self.make_rgb_column)
+
+
+def _backfill_day(job):
+    date, profile, spectro_path, output_folder_base, factors, scaling, line_columns_base, png_columns, emission_index, overwrite = job
+    engine = ColumnEngine(profile, spectro_path, output_folder_base, factors, scaling, line_columns_base, png_columns, emission_index)
+    return date, len(engine.make_day(date, overwrite, threads=1))
+
+# Backfill mode: the columns of every day from start_date to end_date (included), days processed in parallel.
+# On Windows the calling script must run under if __name__ == "__main__".
+def backfill(start_date, end_date, profile="normalised", spectro_path=spectro_path, output_folder_base=output_folder_base,
+             factors=(1, 1, 1), scaling=None, line_columns_base=None, png_columns=False, emission_index=None, overwrite=False, processes=None):
+    days = [start_date + datetime.timedelta(days=i) for i in range((end_date - start_date).days + 1)]
+    jobs = [(day, profile, spectro_path, output_folder_base, factors, scaling, line_columns_base, png_columns, emission_index, overwrite) for day in days]
+    start = time.perf_counter()
+    total = 0
+    with ProcessPoolExecutor(max_workers=processes) as pool:
+        for future in as_completed([pool.submit(_backfill_day, job) for job in jobs]):
+            day, count = future.result()
+            total += count
+            if count:
+                print(f"{day:%Y/%m/%d}: {count} RGB columns")
+    print(f"Backfilled {total} RGB columns over {len(days)} days in {time.perf_counter() - start:.1f} s")
+    return total
+
+def parse_date(date_string):
+    return datetime.datetime.strptime(date_string, "%Y/%m/%d").date()
+
+def main():
+    parser = argparse.ArgumentParser(description="Make the RGB-columns of MISS2, live or for a range of past dates.")
+    parser.add_argument("--profile", default="normalised", choices=sorted(column_profiles), help="Rows, spatial range and scaling")
+    parser.add_argument("--scaling", choices=sorted(scalings), help="Overrides the scaling of the profile")
+    parser.add_argument("--factors", type=float, nargs=3, default=(1, 1, 1), metavar=("RED", "GREEN", "BLUE"), help="Channel gains")
+    parser.add_argument("--start", type=parse_date, help="First day to backfill (yyyy/mm/dd), live mode if omitted")
+    parser.add_argument("--end", type=parse_date, help="Last day to backfill (yyyy/mm/dd), defaults to --start")
+    parser.add_argument("--overwrite", action="store_true", help="Remake the columns that already exist")
+    parser.add_argument("--processes", type=int, default=None, help="Processes of the backfill (default: one per CPU)")
+    parser.add_argument("--spectro-path", default=spectro_path, help="Directory of the averaged spectrograms")
+    parser.add_argument("--output-folder", default=output_folder_base, help="Directory of the RGB-columns")
+    parser.add_argument("--line-columns", nargs="?", const=line_columns_base, default=None,
+                        help="Also make the multi-channel columns of the calibrated bands (optionally in this directory)")
+    parser.add_argument("--png-columns", action="store_true", help="Also save every RGB-column as a PNG file")
+    parser.add_argument("--emission-index", nargs="?", const=emission_index_path, default=None,
+                        help="Also index the per-minute line intensities in SQLite (optionally in this file)")
+    args = parser.parse_args()
+
+    if args.start is None:
+        ColumnEngine(args.profile, args.spectro_path, args.output_folder, tuple(args.factors), args.scaling, args.line_columns, args.png_columns,
+                     args.emission_index).run_live()
+    else:
+        backfill(args.start, args.end or args.start, args.profile, args.spectro_path, args.output_folder, tuple(args.factors),
+                 args.scaling, args.line_columns, args.png_columns, args.emission_index, args.overwrite, args.processes)
+
+if __name__ == "__main__":
+    main()
@@ -6,84 +6,100 @@ Averages the raw PNG captured by the Atik 414EX detector minute-wise and saves a
 import os
 import datetime
 import time
-import numpy as np
 from PIL import Image
-import re
-from collections import defaultdict
-
-def average_images(PNG_folder, raw_PNG_folder, current_time, processed_minutes):
-    images_by_minute = defaultdict(list)
-    filename_regex = re.compile(r'^.+-(\d{8})-(\d{6})\.png$') #regex 
-
+import numpy as np
+from frame_stacking import stack_frames, stack_minutes, make_decode_pool
+from raw_frame_index import RawFrameIndex
+from processing_checkpoint import ProcessingCheckpoint
+
+# Save the average of a minute in its date directory and record it in the checkpoint
+def save_averaged_image(PNG_folder, minute_key, averaged_image, frame_count, averaged_count, processed_minutes):
+    year, month, day, hour, minute = minute_key[:4], minute_key[4:6], minute_key[6:8], minute_key[9:11], minute_key[11:]
+    save_folder = os.path.join(PNG_folder, year, month, day)
+    os.makedirs(save_folder, exist_ok=True)
+    averaged_image_path = os.path.join(save_folder, f"MISS2-{year}{month}{day}-{hour}{minute}00.png")
+
+    # Convert numpy array back to an Image object and specify the mode for 16-bit
+    averaged_img = Image.fromarray(averaged_image, mode='I;16')
+    averaged_img.save(averaged_image_path)
+    print(f"Saved averaged image: {averaged_image_path}")
+
+    # Record the minute in the checkpoint of its day
+    processed_minutes.mark_done(minute_key, frame_count, averaged_count, averaged_image_path)
+
+# Save the per-pixel variance and number of frames kept of a minute (kept out of the averaged folder, which only holds images)
+def save_stack_statistics(statistics_folder, minute_key, stack_statistics, method):
+    year, month, day, hour, minute = minute_key[:4], minute_key[4:6], minute_key[6:8], minute_key[9:11], minute_key[11:]
+    save_folder = os.path.join(statistics_folder, year, month, day)
+    os.makedirs(save_folder, exist_ok=True)
+    statistics_path = os.path.join(save_folder, f"MISS2-{year}{month}{day}-{hour}{minute}00-stats.npz")
+    np.savez_compressed(statistics_path, variance=stack_statistics["variance"], count=stack_statistics["count"], method=method)
+
+# decode_pool: threads decoding the frames of a minute, catch_up_processes: processes used when at least
+# catch_up_minutes minutes are waiting (after downtime), 1 to always average minute by minute.
+# stacking_method: "mean", "median", "sigma_clip" or "minmax" (see frame_stacking.py), statistics_folder: where the
+# per-pixel variance and count of each minute are saved, None not to compute them
+def average_images(PNG_folder, frame_index, current_time, processed_minutes, decode_pool=None, catch_up_processes=1, catch_up_minutes=10,
+                   stacking_method="mean", statistics_folder=None):
     # Convert current time to UTC
     current_time_utc = current_time.astimezone(datetime.timezone.utc)
 
-    # Group images based on the minute they belong to
-    for root, dirs, files in os.walk(raw_PNG_folder):
-        for filename in files:
-            filepath = os.path.join(root, filename)
-            match = filename_regex.match(filename)
-            if match:
-                date_part, time_part = match.groups()
-                image_date = datetime.datetime.strptime(date_part, "%Y%m%d").replace(tzinfo=datetime.timezone.utc).date()
-                current_date = current_time_utc.date()
-                if image_date == current_date:
-                    image_utc = datetime.datetime.strptime(date_part + time_part[:4], "%Y%m%d%H%M").replace(tzinfo=datetime.timezone.utc)
-                    prev_minute = current_time_utc - datetime.timedelta(minutes=1)
-                    if image_utc < prev_minute:
-                        images_by_minute[date_part + '-' + time_part[:4]].append(filepath)
-
-    # Process each minute-group of images IF not already processed
-    for minute_key, filepaths in images_by_minute.items():
-        if minute_key not in processed_minutes:  # Check if the minute has already been processed
+    # Index the raw frames written since the last update, grouped by the minute they belong to
+    frame_index.scan(current_time_utc)
+    # Only the checkpoints of the watched days are kept in memory, the earlier days are not averaged anymore
+    processed_minutes.forget_days_except({day.strftime("%Y%m%d") for day in frame_index.watched_days(current_time_utc)})
+
+    # Minutes to process: not processed yet (or raw frames arrived late) and complete
+    ready_minutes = []
+    for minute_key, filepaths in list(frame_index.images_by_minute.items()):
+        if not processed_minutes.is_done(minute_key, len(filepaths)):
             year, month, day, hour, minute = map(int, [minute_key[:4], minute_key[4:6], minute_key[6:8], minute_key[9:11], minute_key[11:]])
             target_utc = datetime.datetime(year, month, day, hour, minute, tzinfo=datetime.timezone.utc)
 
-        # Check if the current time is at least 30 seconds past the next minute
+            # Check if the current time is at least 30 seconds past the next minute
             if target_utc < current_time_utc - datetime.timedelta(minutes=1) and current_time_utc.second >= 30:
+                ready_minutes.append((minute_key, list(filepaths)))
 
-                sum_img_array = None
-                count = 0
-
-                for filepath in filepaths:
-                    try:
-                        img = Image.open(filepath)
-                        img_array = np.array(img)
+    frame_counts = {minute_key: len(filepaths) for minute_key, filepaths in ready_minutes}
+    stack_options = {"method": stacking_method, "statistics": statistics_folder is not None}
 
-                        if sum_img_array is None:
-                            sum_img_array = np.zeros_like(img_array, dtype='float64')
+    # Catching up: many minutes at once across processes
+    if catch_up_processes > 1 and len(ready_minutes) >= catch_up_minutes:
+        print(f"Catching up {len(ready_minutes)} minutes with {catch_up_processes} processes")
+        stacked_minutes = stack_minutes(ready_minutes, catch_up_processes, **stack_options)
+    else:
+        stacked_minutes = ((minute_key, *stack_frames(filepaths, decode_pool, **stack_options)) for minute_key, filepaths in ready_minutes)
 
-                        sum_img_array += img_array
-                        count += 1
-
-                    except Exception as e:
-                        print(f"Error processing image {os.path.basename(filepath)}: {e}")
-
-                # If images were found for this minute, average them and save
-                if count > 0:
-                    averaged_image = (sum_img_array / count).astype(np.uint16)
-                    save_folder = os.path.join(PNG_folder, f"{year:04d}", f"{month:02d}", f"{day:02d}")
-                    os.makedirs(save_folder, exist_ok=True)
-                    averaged_image_path = os.path.join(save_folder, f"MISS2-{year:04d}{month:02d}{day:02d}-{hour:02d}{minute:02d}00.png")
-
-                    # Convert numpy array back to an Image object and specify the mode for 16-bit
-                    averaged_img = Image.fromarray(averaged_image, mode='I;16')
-                    averaged_img.save(averaged_image_path)
-                    print(f"Saved averaged image: {averaged_image_path}")
-
-                    # Update the list of already processed minutes to the list
-                    processed_minutes.append(minute_key)
+    for minute_key, averaged_image, count, stack_statistics in stacked_minutes:
+        # If images were found for this minute, save the average
+        if count > 0:
+            if stack_statistics is not None:
+                save_stack_statistics(statistics_folder, minute_key, stack_statistics, stacking_method)
+            save_averaged_image(PNG_folder, minute_key, averaged_image, frame_counts[minute_key], count, processed_minutes)
 
 raw_PNG_folder = r'C:\Users\auroras\.venvMISS2\MISS2\Captured_PNG\raw_PNG'
 PNG_folder = r'C:\Users\auroras\.venvMISS2\MISS2\Captured_PNG\averaged_PNG'
 
-# List to keep track of processed minutes 
-processed_minutes = []
-
-while True:
-    try:
-        current_time = datetime.datetime.now()
-        average_images(PNG_folder, raw_PNG_folder, current_time, processed_minutes)
-        time.sleep(30 - (current_time.second % 30))  # Sleep until 30 seconds past the minute
-    except Exception as e:
-        print(f"An error occurred: {e}")
+# Minutes already averaged, checkpointed per day next to the averaged images so that a restart resumes where it stopped
+processed_minutes = ProcessingCheckpoint(PNG_folder)
+
+# Index of the raw frames of the current day, updated with the new files only
+frame_index = RawFrameIndex(raw_PNG_folder)
+
+decode_threads = 4  # Frames of a minute decoded in parallel
+catch_up_processes = max(1, (os.cpu_count() or 1) - 1)  # Processes averaging the backlog after downtime
+catch_up_minutes = 10  # Backlog (minutes) from which the process pool is used
+
+stacking_method = "mean"  # "mean", "median", "sigma_clip" (cosmic-ray rejection) or "minmax"
+statistics_folder = None  # e.g. r'C:\Users\auroras\.venvMISS2\MISS2\Captured_PNG\stack_statistics' to save variance/count per minute
+
+if __name__ == "__main__":
+    frame_decode_pool = make_decode_pool(decode_threads)
+    while True:
+        try:
+            current_time = datetime.datetime.now()
+            average_images(PNG_folder, frame_index, current_time, processed_minutes, frame_decode_pool, catch_up_processes, catch_up_minutes,
+                           stacking_method, statistics_folder)
+            time.sleep(30 - (current_time.second % 30))  # Sleep until 30 seconds past the minute
+        except Exception as e:
+            print(f"An error occurred: {e}")
@@ -0,0 +1,142 @@
+'''
+Delivers the newly completed averaged spectrograms to the RGB-column engine, instead of listing the day directory every
+60 s. average_PNG_maker.py records a minute in the manifest of its day (processing_checkpoint.py) only after the averaged
+image is written, so the watcher stats that one small file every poll_interval (0.5 s) and reads it again only when it
+changed: a new averaged frame is delivered within a second of being complete, never half written, and a minute averaged
+again with late raw frames is delivered again.
+
+The delivered minutes are checkpointed per day next to the columns (column-checkpoint-yyyymmdd.json), so a restart picks up
+exactly the minutes it missed. The previous UTC day is still watched for rollover_minutes after midnight (its last minute
+is averaged after 00:00), then dropped with its state.
+
+Days without a manifest (e.g. averaged images copied in by hand) fall back to the PNG files of the day directory that have
+not been modified for settle_seconds.
+
+'''
+
+import os
+import time
+import datetime
+
+from processing_checkpoint import ProcessingCheckpoint
+
+
+class AveragedFrameWatcher:
+    # averaged_folder: directory of the averaged spectrograms (yyyy/mm/dd), state_folder: where the delivered minutes are
+    # checkpointed, poll_interval: seconds between two checks, rollover_minutes: how long after midnight (UTC) the previous
+    # day is still watched, settle_seconds: age of a file of a day without manifest before it counts as complete,
+    # retry_interval: seconds before a frame that could not be processed is delivered again
+    def __init__(self, averaged_folder, state_folder, poll_interval=0.5, rollover_minutes=5, settle_seconds=2, retry_interval=60):
+        self.averaged_folder = averaged_folder
+        self.poll_interval = poll_interval
+        self.rollover_minutes = rollover_minutes
+        self.settle_seconds = settle_seconds
+        self.retry_interval = retry_interval
+        self.averaged_minutes = ProcessingCheckpoint(averaged_folder)  # Manifests written by average_PNG_maker.py
+        self.delivered_minutes = ProcessingCheckpoint(state_folder, name="column-checkpoint")
+        self.stamps = {}  # "yyyymmdd" -> stamp of the manifest (or directory) of the day when it was last read
+        self.retries = {}  # minute_key -> (frame, monotonic time of the next attempt)
+
+    def day_folder(self, date):
+        return os.path.join(self.averaged_folder, date.strftime("%Y"), date.strftime("%m"), date.strftime("%d"))
+
+    # Averaged spectrogram of a minute ("yyyymmdd-hhmm"), as named by average_PNG_maker.py
+    def frame_path(self, minute_key):
+        return os.path.join(self.averaged_folder, minute_key[:4], minute_key[4:6], minute_key[6:8], f"MISS2-{minute_key}00.png")
+
+    # Days whose averaged spectrograms may still arrive
+    def watched_days(self, current_time_utc):
+        today = current_time_utc.date()
+        days = [today]
+        if current_time_utc.hour == 0 and current_time_utc.minute < self.rollover_minutes:
+            days.insert(0, today - datetime.timedelta(days=1))
+        return days
+
+    # New averaged frames since the last poll: [(minute_key, raw frame count, averaged frame count, path)], oldest first
+    def poll(self, current_time_utc=None):
+        if current_time_utc is None:
+            current_time_utc = datetime.datetime.now(datetime.timezone.utc)
+        days = self.watched_days(current_time_utc)
+        self._forget_days_except({day.strftime("%Y%m%d") for day in days})
+
+        frames = {}
+        for day in days:
+            for frame in self._new_frames(day):
+                frames[frame[0]] = frame
+        now = time.monotonic()
+        for minute_key, (frame, retry_time) in self.retries.items():
+            if retry_time <= now:
+                frames.setdefault(minute_key, frame)
+        return [frames[minute_key] for minute_key in sorted(frames)]
+
+    # Pass the new frames to make_column (path -> None if the frame could not be processed) and checkpoint the ones
+    # processed. Returns the number of frames processed.
+    def deliver(self, make_column, current_time_utc=None):
+        processed = 0
+        for frame in self.poll(current_time_utc):
+            minute_key, frame_count, averaged_count, path = frame
+            if make_column(path) is None:
+                self.retries[minute_key] = (frame, time.monotonic() + self.retry_interval)
+                continue
+            self.retries.pop(minute_key, None)
+            try:
+                self.delivered_minutes.mark_done(minute_key, frame_count, averaged_count, path)
+            except OSError as e:
+                print(f"Could not checkpoint the column of {path}: {e}")
+            processed += 1
+        return processed
+
+    def run(self, make_column):
+        while True:
+            self.deliver(make_column)
+            time.sleep(self.poll_interval)
+
+    def _new_frames(self, day):
+        day_key = day.strftime("%Y%m%d")
+        try:
+            manifest = os.stat(self.averaged_minutes.manifest_path(day_key))
+        except FileNotFoundError:
+            return self._settled_frames(day)
+        stamp = (manifest.st_mtime_ns, manifest.st_size)
+        if self.stamps.get(day_key) == stamp:
+            return []
+        self.stamps[day_key] = stamp
+
+        entries = self.averaged_minutes.reload(day_key)
+        return [(minute_key, entry["frames"], entry["averaged"], self.frame_path(minute_key)) for minute_key, entry in entries.items()
+                if not self.delivered_minutes.is_done(minute_key, entry["frames"])]
+
+    # Frames of a day without manifest: PNG files not modified for settle_seconds. The directory is listed again only
+    # when it changed or while some of its files are still settling.
+    def _settled_frames(self, day):
+        day_key = day.strftime("%Y%m%d")
+        folder = self.day_folder(day)
+        try:
+            stamp = os.stat(folder).st_mtime_ns
+            if self.stamps.get(day_key) == stamp:
+                return []
+            with os.scandir(folder) as entries:
+                files = [(entry.name, entry.stat().st_mtime) for entry in entries if entry.name.startswith("MISS2-") and entry.name.endswith(".png")]
+        except FileNotFoundError:
+            return []
+
+        settled_time = time.time() - self.settle_seconds
+        frames, settling = [], False
+        for filename, modification_time in files:
+            minute_key = filename[6:19]
+            if modification_time > settled_time:
+                settling = True
+            elif not self.delivered_minutes.is_done(minute_key, 0):
+                frames.append((minute_key, 0, 0, os.path.join(folder, filename)))
+        if not settling:
+            self.stamps[day_key] = stamp
+        return frames
+
+    # Drop the state of the days that are not watched anymore
+    def _forget_days_except(self, day_keys):
+        self.averaged_minutes.forget_days_except(day_keys)
+        self.delivered_minutes.forget_days_except(day_keys)
+        for day_key in [day_key for day_key in self.stamps if day_key not in day_keys]:
+            del self.stamps[day_key]
+        for minute_key in [minute_key for minute_key in self.retries if minute_key[:8] not in day_keys]:
+            del self.retries[minute_key]
@@ -0,0 +1,117 @@
+'''
+Per-frame time of the RGB-column engine (RGB_column_engine.py) on synthetic averaged spectrograms of the simulated Atik
+414EX: PNG decoding, extraction of the emission lines (median filter, background, scaling), a whole live column
+(decode once, extract, save), and the batched pass used by the backfill on the same spectrograms. For comparison, the
+column of the former makers is timed too (integrity check decoding twice, then one decode per emission line, median filter
+of the line rows, scaling of the profile, resize and PNG column) and compared with the column of the engine.
+
+Example: python benchmark_RGB_columns.py --frames 20 --profile normalised --binning 2
+
+'''
+
+import os
+import io
+import time
+import shutil
+import argparse
+import tempfile
+import datetime
+import contextlib
+import numpy as np
+from PIL import Image
+from scipy import signal
+
+import simulated_AtikSDK
+from emission_line_extraction import rgb_columns, scalings
+from RGB_column_engine import ColumnEngine, column_profiles
+
+
+# RGB-column of a spectrogram as made by the former column makers (verify_image_integrity, then PNG_to_RGB decoding the
+# file again for each emission line), with the channel factors and scaling of the profile, saved as a PNG column in
+# output_folder. Returns the (300, 1, 3) column.
+def legacy_column(png_file_path, rows, south_column, north_column, factors, scaling, output_folder):
+    with Image.open(png_file_path) as img:
+        img.verify()
+    with Image.open(png_file_path) as img:
+        img.load()
+
+    channels = []
+    for emission_row in rows:
+        with Image.open(png_file_path) as img:
+            spectro_array = np.array(img)
+        extracted_rows = spectro_array[max(emission_row - 1, 0):min(emission_row + 1, spectro_array.shape[0]), south_column:north_column]
+        processed_rows = signal.medfilt2d(extracted_rows.astype('float32'))
+        processed_rows = np.maximum(0, processed_rows - np.average(processed_rows[0:30, 0:30]))
+        channels.append(np.mean(processed_rows, axis=0).reshape(-1, 1))
+
+    RGB_image = scalings[scaling](np.dstack(channels) * np.asarray(factors, dtype=np.float32))  # (columns, 1, 3)
+    resized_RGB_image = Image.fromarray(RGB_image).resize((1, 300), Image.Resampling.LANCZOS)
+    resized_RGB_image.save(os.path.join(output_folder, os.path.basename(png_file_path)))
+    return np.array(resized_RGB_image)
+
+def run_benchmark(frames, binning, profile, work_dir):
+    camera = simulated_AtikSDK.AtikSDKCamera(readout_time=0, seed=0)
+    camera.set_binning(binning, binning)
+    engine = ColumnEngine(profile, os.path.join(work_dir, "averaged_PNG"), os.path.join(work_dir, "RGB_columns"))
+
+    date = datetime.date(2024, 5, 5)
+    spectro_folder = engine.input_folder(date)
+    os.makedirs(spectro_folder)
+    paths = []
+    for i in range(frames):
+        path = os.path.join(spectro_folder, f"MISS2-{date:%Y%m%d}-{i // 60:02d}{i % 60:02d}00.png")
+        Image.fromarray(np.flipud(camera.take_image(0.05))).save(path)
+        paths.append(path)
+
+    start = time.perf_counter()
+    spectrograms = []
+    for path in paths:
+        with Image.open(path) as img:
+            spectrograms.append(np.array(img))
+    decode_time = (time.perf_counter() - start) / frames
+
+    start = time.perf_counter()
+    columns = []
+    for spectro_array in spectrograms:
+        columns.append(rgb_columns(engine.extractor.profiles([engine.extractor.bands(spectro_array)]), engine.factors, engine.scaling)[0])
+    extraction_time = (time.perf_counter() - start) / frames
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        for path in paths:
+            engine.make_rgb_column(path, engine.output_folder(date))
+        live_time = (time.perf_counter() - start) / frames
+
+        start = time.perf_counter()
+        engine.make_day(date, overwrite=True)
+        batch_time = (time.perf_counter() - start) / frames
+
+    legacy_folder = os.path.join(work_dir, "legacy_RGB_columns")
+    os.makedirs(legacy_folder)
+    start = time.perf_counter()
+    legacy_columns = []
+    for path in paths:
+        legacy_columns.append(legacy_column(path, engine.rows, engine.south_column, engine.north_column, engine.factors, engine.scaling, legacy_folder))
+    legacy_time = (time.perf_counter() - start) / frames
+    difference = max(np.abs(column.astype(int) - legacy.astype(int)).max() for column, legacy in zip(columns, legacy_columns))
+
+    print(f"{frames} spectrograms of {spectrograms[0].shape[1]}x{spectrograms[0].shape[0]} pixels, profile: {profile}")
+    print(f"{'Decode (ms)':>12}{'Extract (ms)':>14}{'Live (ms)':>11}{'Batch (ms)':>12}{'Former (ms)':>13}")
+    print(f"{decode_time * 1000:>12.1f}{extraction_time * 1000:>14.2f}{live_time * 1000:>11.1f}{batch_time * 1000:>12.1f}{legacy_time * 1000:>13.1f}")
+    print(f"Largest difference between the columns of the engine and of the former makers: {difference} (8-bit levels)")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the RGB-column engine of MISS2.")
+    parser.add_argument("--frames", type=int, default=20, help="Number of averaged spectrograms")
+    parser.add_argument("--binning", type=int, default=2, help="Horizontal and vertical binning (sets the frame size)")
+    parser.add_argument("--profile", default="normalised", choices=sorted(column_profiles), help="Column profile")
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix="MISS2-columns-")
+    try:
+        run_benchmark(args.frames, args.binning, args.profile, work_dir)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
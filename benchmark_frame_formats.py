@@ -0,0 +1,66 @@
+'''
+Write time versus disk footprint of the raw frame formats supported by capture_Atik.py (PNG at several compression levels,
+uncompressed FITS, raw npy), measured on synthetic spectrograms of the simulated Atik 414EX.
+
+Example: python benchmark_frame_formats.py --frames 20 --binning 2
+
+'''
+
+import os
+import time
+import shutil
+import argparse
+import tempfile
+import numpy as np
+
+import simulated_AtikSDK
+from frame_formats import frame_saver, frame_extensions, read_frame
+
+
+def run_benchmark(frames, binning, png_levels, work_dir):
+    camera = simulated_AtikSDK.AtikSDKCamera(readout_time=0, seed=0)
+    camera.set_binning(binning, binning)
+    images = [np.flipud(camera.take_image(0.05)) for _ in range(frames)]
+    metadata = {"Exposure Time": "0.05 seconds", "Date/Time": "20240505-011000", "Temperature": "-10.0 C",
+                "Note": "MISS2 KHO/UNIS", "Binning": f"{binning}x{binning}"}
+
+    candidates = [(f"png (level {level})", "png", level) for level in png_levels] + [("fits", "fits", 0), ("npy", "npy", 0)]
+    raw_size = images[0].nbytes
+
+    print(f"{frames} frames of {images[0].shape[1]}x{images[0].shape[0]} pixels ({raw_size / 1024:.0f} KiB uncompressed)")
+    print(f"{'Format':<16}{'Write (ms)':>12}{'Read (ms)':>12}{'Size (KiB)':>12}{'Ratio':>8}")
+    for label, raw_format, level in candidates:
+        save = frame_saver(raw_format, level)
+        paths = [os.path.join(work_dir, f"frame-{i}{frame_extensions[raw_format]}") for i in range(frames)]
+
+        start = time.perf_counter()
+        for path, image in zip(paths, images):
+            save(path, image, metadata)
+        write_time = (time.perf_counter() - start) / frames
+
+        start = time.perf_counter()
+        for path, image in zip(paths, images):
+            if not np.array_equal(read_frame(path), image):
+                raise RuntimeError(f"{label}: frame read back differs from the frame written")
+        read_time = (time.perf_counter() - start) / frames
+
+        size = np.mean([os.path.getsize(path) for path in paths])
+        print(f"{label:<16}{write_time * 1000:>12.1f}{read_time * 1000:>12.1f}{size / 1024:>12.0f}{size / raw_size:>8.2f}")
+        for path in paths:
+            os.remove(path)
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the raw frame formats of MISS2.")
+    parser.add_argument("--frames", type=int, default=10, help="Number of frames written per format")
+    parser.add_argument("--binning", type=int, default=2, help="Horizontal and vertical binning (sets the frame size)")
+    parser.add_argument("--png-levels", type=int, nargs="+", default=[0, 1, 3, 6, 9], help="PNG compression levels to test")
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix="MISS2-formats-")
+    try:
+        run_benchmark(args.frames, args.binning, args.png_levels, work_dir)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
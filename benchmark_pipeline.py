@@ -0,0 +1,163 @@
+'''
+End-to-end throughput benchmark of the MISS2 processing chain on any machine: a simulated Atik 414EX (simulated_AtikSDK.py)
+feeds the real stages capture -> minute average (average_PNG_maker.py) -> RGB-column (RGB column maker) -> keogram
+(keogram_maker.py) in a scratch directory, and the frames/s, per-stage latency and end-to-end delay are reported.
+
+Example: python benchmark_pipeline.py --minutes 5 --cadence 5 --binning 2
+
+'''
+
+import os
+import io
+import time
+import shutil
+import argparse
+import tempfile
+import datetime
+import importlib
+import contextlib
+import numpy as np
+
+import simulated_AtikSDK
+from frame_formats import save_png_frame
+from raw_frame_index import RawFrameIndex
+from processing_checkpoint import ProcessingCheckpoint
+from RGB_column_engine import ColumnEngine
+from keogram_renderer import KeogramRenderer
+
+
+# Latency statistics of one stage
+def describe(latencies):
+    latencies = np.array(latencies)
+    return latencies.size, latencies.sum(), latencies.mean(), latencies.max()
+
+# render: "fast" (KeogramRenderer), "matplotlib" (save_keogram) or None
+def run_benchmark(minutes, cadence, binning, exposure_duration, readout_time, start_time, column_maker_name, render, work_dir, verbose):
+    # The stages print a line per file, keep the benchmark output readable unless asked otherwise
+    quiet = contextlib.nullcontext if verbose else (lambda: contextlib.redirect_stdout(io.StringIO()))
+
+    with quiet():
+        import average_PNG_maker
+        import keogram_maker
+        column_maker = importlib.import_module(column_maker_name)
+
+    raw_folder = os.path.join(work_dir, "raw_PNG")
+    averaged_folder = os.path.join(work_dir, "averaged_PNG")
+    column_folder = os.path.join(work_dir, "RGB_columns")
+    keogram_folder = os.path.join(work_dir, "Keograms")
+    if getattr(column_maker, "engine", None) is not None:
+        # Column engine writing into the scratch directory (daily column stores, line intensities and emission index if enabled)
+        line_columns_base = os.path.join(work_dir, "line_columns") if column_maker.engine.line_columns_base else None
+        emission_index = os.path.join(work_dir, "emission_index.sqlite") if column_maker.engine.emission_index else None
+        column_maker.engine = ColumnEngine(column_maker.engine.profile, averaged_folder, column_folder, column_maker.engine.factors,
+                                           column_maker.engine.scaling, line_columns_base, column_maker.engine.png_columns, emission_index)
+
+    camera = simulated_AtikSDK.AtikSDKCamera(readout_time=readout_time, seed=0)
+    camera.connect()
+    camera.set_binning(binning, binning)
+
+    latencies = {"capture": [], "average": [], "column": [], "keogram": [], "render": []}
+    end_to_end = []
+    processed_minutes = ProcessingCheckpoint(averaged_folder)
+    frame_index = RawFrameIndex(raw_folder)
+    daily_keogram = None
+    renderer = KeogramRenderer()
+    frames_per_minute = int(round(60 / cadence))
+    benchmark_start = time.perf_counter()
+
+    for m in range(minutes):
+        minute_time = start_time + datetime.timedelta(minutes=m)
+
+        # Capture: exposure/read-out (simulated), flip and save every raw frame of the minute
+        for i in range(frames_per_minute):
+            capture_time = minute_time + datetime.timedelta(seconds=i * cadence)
+            start = time.perf_counter()
+            uint16_array = np.flipud(camera.take_image(exposure_duration).astype(np.uint16))
+            timestamp = capture_time.strftime("%Y%m%d-%H%M%S")
+            if cadence % 1:
+                timestamp += f"-{capture_time.microsecond // 1000:03d}"
+            image_path = os.path.join(raw_folder, capture_time.strftime("%Y/%m/%d"), f"MISS2-{timestamp}.png")
+            os.makedirs(os.path.dirname(image_path), exist_ok=True)
+            save_png_frame(image_path, uint16_array, {"Date/Time": timestamp, "Note": "MISS2 benchmark"})
+            latencies["capture"].append(time.perf_counter() - start)
+        last_frame_saved = time.perf_counter()
+
+        # Averaging: the minute is complete once the averaging script runs 30 s into the next minute
+        start = time.perf_counter()
+        with quiet():
+            average_PNG_maker.average_images(averaged_folder, frame_index, minute_time + datetime.timedelta(seconds=90), processed_minutes)
+        latencies["average"].append(time.perf_counter() - start)
+        averaged_path = os.path.join(averaged_folder, minute_time.strftime("%Y/%m/%d"), minute_time.strftime("MISS2-%Y%m%d-%H%M00.png"))
+
+        # RGB-column of the averaged spectrogram
+        start = time.perf_counter()
+        output_folder = os.path.join(column_folder, minute_time.strftime("%Y/%m/%d"))
+        os.makedirs(output_folder, exist_ok=True)
+        with quiet():
+            column_maker.make_rgb_column(averaged_path, output_folder)
+        latencies["column"].append(time.perf_counter() - start)
+
+        # Keogram update with the new column
+        start = time.perf_counter()
+        if daily_keogram is None or daily_keogram.date != minute_time.date():
+            daily_keogram = keogram_maker.DailyKeogram(minute_time.date(), column_folder, keogram_folder)
+        with quiet():
+            daily_keogram.update(now_UT=minute_time + datetime.timedelta(minutes=1))
+        latencies["keogram"].append(time.perf_counter() - start)
+        end_to_end.append(time.perf_counter() - last_frame_saved)
+
+        # Rendering of the keogram figure (composited into the pre-rendered frame, or whole matplotlib figure)
+        if render:
+            start = time.perf_counter()
+            with quiet():
+                if render == "matplotlib":
+                    keogram_maker.save_keogram(daily_keogram.keogram, keogram_folder, daily_keogram.date)
+                else:
+                    renderer.save(daily_keogram.keogram, keogram_folder, daily_keogram.date)
+            latencies["render"].append(time.perf_counter() - start)
+
+    total_time = time.perf_counter() - benchmark_start
+    camera.disconnect()
+
+    frame_shape = camera.image_shape()
+    print(f"Simulated {minutes} min at {cadence} s cadence, frames {frame_shape[1]}x{frame_shape[0]} (binning {binning}x{binning}), column maker: {column_maker_name}")
+    print(f"{'Stage':<10}{'Count':>8}{'Items/s':>12}{'Mean (ms)':>12}{'Max (ms)':>12}")
+    for stage, values in latencies.items():
+        if not values:
+            continue
+        count, stage_total, mean, maximum = describe(values)
+        print(f"{stage:<10}{count:>8}{count / stage_total:>12.2f}{mean * 1000:>12.1f}{maximum * 1000:>12.1f}")
+
+    count, _, mean, maximum = describe(end_to_end)
+    print(f"End-to-end delay (last raw frame of a minute saved -> keogram updated): mean {mean * 1000:.1f} ms, max {maximum * 1000:.1f} ms")
+    frames = len(latencies["capture"])
+    print(f"Overall: {frames / total_time:.2f} frames/s, {total_time / minutes:.2f} s of processing per simulated minute "
+          f"(real time needs < 60 s, capture needs < {cadence} s per frame)")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the MISS2 processing chain with a simulated camera.")
+    parser.add_argument("--minutes", type=int, default=3, help="Number of simulated minutes")
+    parser.add_argument("--cadence", type=float, default=5, help="Seconds between two frames")
+    parser.add_argument("--binning", type=int, default=2, help="Horizontal and vertical binning (sets the frame size)")
+    parser.add_argument("--exposure", type=float, default=0.05,
+                        help="Simulated exposure time (s, the one of capture_Atik.py), also scales the emission lines of the frames")
+    parser.add_argument("--readout", type=float, default=0.0, help="Simulated read-out time (s)")
+    parser.add_argument("--start", default="2024-05-05T01:00", help="UTC start time of the simulated data (yyyy-mm-ddThh:mm)")
+    parser.add_argument("--column-maker", default="normalised_RGB_column_maker", help="Module used for the RGB-columns")
+    parser.add_argument("--no-render", action="store_true", help="Skip the rendering of the keogram")
+    parser.add_argument("--matplotlib-render", action="store_true", help="Render the whole matplotlib figure at every update")
+    parser.add_argument("--work-dir", help="Directory for the generated files (a temporary directory is used and removed otherwise)")
+    parser.add_argument("--verbose", action="store_true", help="Show the output of the stages")
+    args = parser.parse_args()
+
+    start_time = datetime.datetime.strptime(args.start, "%Y-%m-%dT%H:%M").replace(tzinfo=datetime.timezone.utc)
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix="MISS2-benchmark-")
+    try:
+        run_benchmark(args.minutes, args.cadence, args.binning, args.exposure, args.readout, start_time,
+                      args.column_maker, None if args.no_render else "matplotlib" if args.matplotlib_render else "fast", work_dir, args.verbose)
+    finally:
+        if not args.work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
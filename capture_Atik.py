@@ -4,11 +4,22 @@ This program controls all the Atik414EX functions and the way the raw scaled PNG
 ''' #Last update 11.05.2024 - implementation of binning options and init of the camera left
 
 import os
-import numpy as np
-import datetime
-from PIL import Image, PngImagePlugin
-import AtikSDK
-import time
+import threading
+from frame_writer import FrameWriter, save_frame_atomically
+from frame_formats import frame_saver, frame_extensions
+from capture_scheduler import CaptureScheduler
+from minute_stacker import MinuteStacker
+from overlapped_acquisition import FastModeAcquisition
+from cooler_telemetry import CoolerTelemetry
+from frame_ring_buffer import FrameRingBuffer
+from frame_bus import FrameBusPublisher, frames_bus_name, minutes_bus_name
+
+# Run the capture without the detector (simulated Atik 414EX of simulated_AtikSDK.py), e.g. to test or time the software
+use_simulated_camera = False
+if use_simulated_camera:
+    import simulated_AtikSDK as AtikSDK
+else:
+    import AtikSDK
 
 
 
@@ -17,16 +28,58 @@ import time
 # Path to the yyy/mm/dd date directory where all new captured images will be saved.
 raw_PNG_folder = os.path.join(os.path.expanduser("~"), ".venvMISS2/MISS2/Captured_PNG/raw_PNG")
 
+# Path to the yyy/mm/dd date directory where the minute averages stacked at capture time are saved (same as average_PNG_maker.py)
+averaged_PNG_folder = os.path.join(os.path.expanduser("~"), ".venvMISS2/MISS2/Captured_PNG/averaged_PNG")
+
+# Path to the directory where the nightly cooler telemetry logs (CSV) are saved
+telemetry_folder = os.path.join(os.path.expanduser("~"), ".venvMISS2/MISS2/Telemetry")
+
 
 camera = AtikSDK.AtikSDKCamera() 
 exposure_duration = 0.05  # Exposure time per image, in seconds
 optimal_temperature = 0 # Optimal Temperature for cooling
-imaging_cadence = 5 # Capture images every X second
+imaging_cadence = 5 # Capture images every X second (fractional cadences such as 0.5 are allowed)
+
+# Acquisition mode: "blocking" takes one image (take_image) per cadence slot, "fast" keeps the camera exposing continuously
+# and reads frame N out while frame N+1 is exposing (high-cadence bursts during active aurora, imaging_cadence is not used)
+acquisition_mode = "blocking"
+fast_queue_size = 8 # Number of read-out frames allowed to wait in fast mode before new frames are dropped
+
+# Raw frames are handed to background writer thread(s) so that PNG encoding and disk access never delay the next exposure
+asynchronous_writing = True
+writer_threads = 1 # Number of background writer threads
+writer_queue_size = 4 # Number of frames allowed to wait for the writer before new frames are dropped
+writer_put_timeout = 0.0 # Seconds a new frame may wait for room in the queue (back-pressure) before being dropped, 0 = never wait
+
+# Format of the raw frames: "png" (zlib level png_compress_level, 0 = none ... 9 = smallest), "fits" (uncompressed,
+# exposure/temperature/binning/time in the header) or "npy" (raw array, no metadata). The minute averages are always PNG.
+# See benchmark_frame_formats.py for write time versus disk footprint: on MISS2 spectrograms level 1 writes ~7x faster than
+# PIL's default level 6 for ~5% larger files.
+raw_format = "png"
+png_compress_level = 1
+
+# Frames are averaged minute-wise in memory and the averaged PNG is saved as soon as the minute is over. Off by default:
+# the averages go to the same files as those of average_PNG_maker.py (started by main.py), without its per-day manifest,
+# so only enable it with average_PNG_maker.py stopped. The column engine then finds them through the files of the day.
+stack_at_capture = False
+save_raw_frames = True # Set to False (with stack_at_capture) to only keep the minute averages
+
+# Temperature, cooling power and window heater are sampled by a background thread, the frames use the latest sample
+telemetry_interval = 10 # Seconds between two telemetry samples
 
 # Horizontal and vertical binning of the images captured and saved
 binX = 2
 binY = 2 
 
+# Frames are copied (and flipped) once into a ring of preallocated buffers that the writer and the stacking borrow
+sensor_width = 1391 # Atik 414EX full-frame columns
+sensor_height = 1039 # Atik 414EX full-frame rows
+frame_buffers = writer_queue_size + writer_threads + 2 # Enough for a full writer queue plus the frames being written/captured
+
+# Every frame and every minute average is also published in shared memory (frame_bus.py) for the live processing scripts
+publish_frame_bus = True
+frame_bus_slots = 8 # Number of frames kept in the shared-memory ring (minute averages: same number of minutes)
+
 # Camera connection and initialisation
 camera.connect()
 if camera.is_connected():
@@ -48,59 +101,170 @@ camera.set_cooling(optimal_temperature)
 # Dark mode for dark frame substraction
 #camera.set_dark_mode(enable=True)
 
+# Metadata saved together with each raw frame
+def build_metadata(timestamp, current_temperature):
+    return {
+        "Exposure Time": str(exposure_duration) + " seconds",
+        "Date/Time": timestamp,
+        "Temperature": f"{current_temperature} C",
+        "Note": "MISS2 KHO/UNIS",
+        "Binning": f"{binX}x{binY}",
+    }
+
+# Saving functions of the raw frames (raw_format) and of the minute averages (always PNG)
+save_raw_file = frame_saver(raw_format, png_compress_level)
+save_averaged_file = frame_saver("png", png_compress_level)
+
+# Save a frame through the background writer if there is one, otherwise right away. on_done is called once the frame
+# has been saved (or dropped), e.g. to give its buffer back to the ring.
+def save_frame(frame_writer, image_path, uint16_array, metadata, save_function, wait=False, on_done=None):
+    if frame_writer:
+        # Queue the frame for the writer thread(s), it is dropped (and counted) if the writer falls behind
+        frame_writer.submit(image_path, uint16_array, metadata, on_done=on_done, wait=wait, save_function=save_function)
+    else:
+        try:
+            save_frame_atomically(save_function, image_path, uint16_array, metadata)
+            print(f"Saved image: {image_path}")
+        finally:
+            if on_done:
+                on_done()
+
+# Serialises the SDK calls of the capture loop and of the telemetry thread
+camera_lock = threading.Lock()
+
+# Blocking acquisition: one exposure (take_image) per scheduler slot
+def scheduled_frames(camera, scheduler):
+    while True:
+        # Sleep precisely until the next exposure slot, current_time is the nominal (UTC) time of that slot
+        current_time, lateness = scheduler.wait_for_next_slot()
+        if lateness > 0.1 * imaging_cadence:
+            print(f"Exposure slot {current_time.strftime('%H:%M:%S.%f')[:-3]} started {lateness * 1000:.0f} ms late")
+
+        # Capture an image with the specified exposure time
+        with camera_lock:
+            image_array = camera.take_image(exposure_duration)
+        yield image_array, current_time
+
 def capture_and_save_images(base_folder, camera ):
 
+    # Start the background writer (if enabled) so that PNG encoding runs next to the exposures
+    frame_writer = None
+    if asynchronous_writing:
+        frame_writer = FrameWriter(num_threads=writer_threads, queue_size=writer_queue_size, put_timeout=writer_put_timeout)
+
+    if acquisition_mode == "fast":
+        # Overlapped exposures, frames arrive through the SDK callback as fast as the camera can deliver them
+        acquisition = FastModeAcquisition(camera, exposure_duration, queue_size=fast_queue_size)
+        frames_per_report = 100
+    else:
+        # Exposure deadlines are taken from a UTC-aligned grid and waited for on the monotonic clock
+        acquisition = CaptureScheduler(imaging_cadence)
+        frames_per_report = max(1, round(60 / imaging_cadence)) # Print the cadence statistics about once a minute
+    millisecond_names = acquisition_mode == "fast" or imaging_cadence % 1
+
+    # Save the average of a minute as soon as it is complete (never dropped by the writer)
+    def save_minute_average(minute_time, averaged_image, count):
+        timestamp = minute_time.strftime("%Y%m%d-%H%M00")
+        averaged_image_path = os.path.join(averaged_PNG_folder, minute_time.strftime("%Y/%m/%d"), f"MISS2-{timestamp}.png")
+        metadata = build_metadata(timestamp, current_temperature)
+        metadata["Averaged frames"] = str(count)
+        save_frame(frame_writer, averaged_image_path, averaged_image, metadata, save_averaged_file, wait=True)
+        if minutes_bus:
+            minutes_bus.publish(averaged_image, minute_time, exposure_duration, current_temperature, binX, binY)
+
+    stacker = MinuteStacker(save_minute_average) if stack_at_capture else None
+    ring = FrameRingBuffer((sensor_height // binY, sensor_width // binX), slots=frame_buffers)
+
+    frames_bus, minutes_bus = None, None
+    if publish_frame_bus:
+        frames_bus = FrameBusPublisher(frames_bus_name, ring.shape, slots=frame_bus_slots)
+        minutes_bus = FrameBusPublisher(minutes_bus_name, ring.shape, slots=frame_bus_slots)
+    current_temperature = "Unknown"
+    frame_count = 0
+
+    telemetry = CoolerTelemetry(camera, telemetry_folder, interval=telemetry_interval, camera_lock=camera_lock)
+
     try:
-        while True:
-            current_time = datetime.datetime.now(datetime.timezone.utc)
-            
-            # Check time to capture images only at fixed time instants
-            if (current_time.second % imaging_cadence != 0):
-                time.sleep(0.5) # Sleep a bit before checking time again
-                continue
+        telemetry.start()
+        if acquisition_mode == "fast":
+            acquisition.start()
+            frames = acquisition.frames()
+        else:
+            frames = scheduled_frames(camera, acquisition)
+
+        for image_array, current_time in frames:
+            # Close the previous minute right away, even if its last frames were lost
+            if stacker:
+                stacker.close_minute_before(current_time)
 
             date_folder = os.path.join(base_folder, current_time.strftime("%Y/%m/%d"))
-            if not os.path.exists(date_folder):
-                os.makedirs(date_folder)
 
-            # Capture an image with the specified exposure time
-            image_array = camera.take_image(exposure_duration)
-            uint16_array = image_array.astype(np.uint16)
+            if image_array.shape != ring.shape:
+                print(f"Frame shape {image_array.shape} differs from the expected {ring.shape}, reallocating the frame buffers")
+                ring = FrameRingBuffer(image_array.shape, slots=frame_buffers)
+                if publish_frame_bus:
+                    frames_bus.close()
+                    minutes_bus.close()
+                    frames_bus = FrameBusPublisher(frames_bus_name, ring.shape, slots=frame_bus_slots)
+                    minutes_bus = FrameBusPublisher(minutes_bus_name, ring.shape, slots=frame_bus_slots)
+
+            # Take a preallocated buffer, the frame is dropped if they are all still waiting to be written
+            slot = ring.acquire()
+            if slot is None:
+                print(f"No free frame buffer, dropped frame {current_time.strftime('%H:%M:%S')}")
+                continue
 
-            # Flip the image vertically if it is saved upside down
-            uint16_array = np.flipud(uint16_array)
+            # Copy into the buffer as 16-bit, flipping the image vertically on the way (it is read out upside down)
+            uint16_array = ring.fill(slot, image_array, flip=True)
 
-            # Retrieve the current temperature
-            try:
-                current_temperature = camera.get_temperature()
-                print("Current temperature:", current_temperature)
-            except Exception as e:
-                print(f"Could not retrieve temperature: {e}")
-                current_temperature = "Unknown"       
+            # Latest temperature sampled by the telemetry thread (no SDK call here)
+            current_temperature = telemetry.latest_temperature()
 
-            # Save the image with metadata
+            # Save the image with metadata (milliseconds are added to the name for sub-second cadences)
             timestamp = current_time.strftime("%Y%m%d-%H%M%S")
-            image_path = os.path.join(date_folder, f"MISS2-{timestamp}.png")
-
-            metadata = PngImagePlugin.PngInfo()
-            metadata.add_text("Exposure Time", str(exposure_duration) + " seconds")
-            metadata.add_text("Date/Time", timestamp)
-            metadata.add_text("Temperature", f"{current_temperature} C")
-            metadata.add_text("Note", "MISS2 KHO/UNIS")
-            metadata.add_text("Binning", f"{binX}x{binY}")
-
-            img = Image.fromarray(uint16_array)
-            img.save(image_path, "PNG", pnginfo=metadata)
-
-            print(f"Saved image: {image_path}")
+            if millisecond_names:
+                timestamp += f"-{current_time.microsecond // 1000:03d}"
+            image_path = os.path.join(date_folder, f"MISS2-{timestamp}{frame_extensions[raw_format]}")
+            metadata = build_metadata(timestamp, current_temperature)
+
+            if stacker:
+                stacker.add(uint16_array, current_time)
+            if frames_bus:
+                frames_bus.publish(uint16_array, current_time, exposure_duration, current_temperature, binX, binY)
+            if save_raw_frames:
+                # The writer borrows the buffer and gives it back once the frame is saved
+                slot.retain()
+                save_frame(frame_writer, image_path, uint16_array, metadata, save_raw_file, on_done=slot.release)
+            slot.release()
+
+            frame_count += 1
+            if frame_count % frames_per_report == 0:
+                print(acquisition.summary())
 
     except Exception as e:
         print(f"Error during image capture and save: {e}")
     finally:
         try:
-            camera.disconnect()
-        except:
-            pass
+            if acquisition_mode == "fast":
+                acquisition.stop()
+            telemetry.stop()
+            print(acquisition.summary())
+            if stacker:
+                # Save the average of the minute in progress
+                stacker.close_minute()
+            if frame_writer:
+                # Flush the frames still waiting in the queue before disconnecting
+                frame_writer.close()
+                print("Frame writer statistics:", frame_writer.stats())
+        finally:
+            # Always remove the shared memory, even if the clean-up above was interrupted
+            if frames_bus:
+                frames_bus.close()
+                minutes_bus.close()
+            try:
+                camera.disconnect()
+            except:
+                pass
 
 try:
     capture_and_save_images(raw_PNG_folder, camera)
@@ -0,0 +1,104 @@
+'''
+Drift-free scheduler for the MISS2 exposures. Exposure deadlines are computed on a UTC-aligned grid (multiples of the
+imaging cadence since the epoch) and waited for on the monotonic clock, so the capture neither fires twice in the same slot
+nor misses slots, and sub-second cadences are possible. Lateness and skipped slots are recorded for every frame.
+
+'''
+
+import math
+import time
+import datetime
+from collections import deque
+
+
+class CaptureScheduler:
+    # cadence: seconds between two exposures (fractional values are allowed, e.g. 0.5)
+    # late_tolerance: a slot whose deadline has passed by less than this is still captured (late) instead of skipped
+    # spin_margin: last part of the wait spent polling the monotonic clock instead of sleeping (OS sleep granularity)
+    # resync_interval: seconds between two re-alignments of the monotonic clock to UTC (follows NTP corrections)
+    def __init__(self, cadence, late_tolerance=None, spin_margin=0.015, resync_interval=60.0, history=1000):
+        if cadence <= 0:
+            raise ValueError("The imaging cadence must be positive")
+        self.cadence = cadence
+        self.late_tolerance = min(cadence / 2, 0.5) if late_tolerance is None else late_tolerance
+        self.spin_margin = spin_margin
+        self.resync_interval = resync_interval
+
+        self.last_slot = None
+        self.frames = 0
+        self.skipped = 0
+        self.total_lateness = 0.0
+        self.max_lateness = 0.0
+        self.lateness_history = deque(maxlen=history)  # Most recent lateness values, for percentiles
+
+        self._resync()
+
+    # Offset between the UTC wall clock and the monotonic clock (best of a few samples to limit the read-out jitter)
+    def _resync(self):
+        best_offset, best_spread = None, None
+        for _ in range(5):
+            before = time.monotonic()
+            wall = time.time()
+            after = time.monotonic()
+            if best_spread is None or after - before < best_spread:
+                best_spread = after - before
+                best_offset = wall - (before + after) / 2
+        self.utc_offset = best_offset
+        self.last_resync = time.monotonic()
+
+    def _slot_deadline(self, slot):
+        # Deadline of a slot on the monotonic clock
+        return slot * self.cadence - self.utc_offset
+
+    def _sleep_until(self, deadline):
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            if remaining > self.spin_margin:
+                time.sleep(remaining - self.spin_margin)
+
+    # Wait for the next exposure slot. Returns its nominal UTC time (datetime) and how late (s) the wake-up was.
+    def wait_for_next_slot(self):
+        if time.monotonic() - self.last_resync > self.resync_interval:
+            self._resync()
+
+        now_utc = time.monotonic() + self.utc_offset
+        slot = math.floor(now_utc / self.cadence)
+        # The current slot is only taken if its deadline passed very recently, otherwise wait for the next one
+        # (the very first frame always waits for a slot to come)
+        if self.last_slot is None or now_utc - slot * self.cadence > self.late_tolerance:
+            slot += 1
+        if self.last_slot is not None:
+            slot = max(slot, self.last_slot + 1)
+            self.skipped += slot - self.last_slot - 1
+
+        deadline = self._slot_deadline(slot)
+        self._sleep_until(deadline)
+        lateness = time.monotonic() - deadline
+
+        self.last_slot = slot
+        self.frames += 1
+        self.total_lateness += lateness
+        self.max_lateness = max(self.max_lateness, lateness)
+        self.lateness_history.append(lateness)
+
+        slot_time = datetime.datetime.fromtimestamp(round(slot * self.cadence, 6), datetime.timezone.utc)
+        return slot_time, lateness
+
+    # Cadence compliance statistics (lateness in seconds)
+    def stats(self):
+        history = sorted(self.lateness_history)
+        p95 = history[min(len(history) - 1, int(0.95 * len(history)))] if history else 0.0
+        return {
+            "frames": self.frames,
+            "skipped": self.skipped,
+            "mean_lateness": self.total_lateness / self.frames if self.frames else 0.0,
+            "p95_lateness": p95,
+            "max_lateness": self.max_lateness,
+        }
+
+    def summary(self):
+        s = self.stats()
+        return (f"Cadence {self.cadence} s: {s['frames']} frames, {s['skipped']} skipped slots, "
+                f"lateness mean {s['mean_lateness'] * 1000:.2f} ms / p95 {s['p95_lateness'] * 1000:.2f} ms / max {s['max_lateness'] * 1000:.2f} ms")
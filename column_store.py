@@ -0,0 +1,166 @@
+'''
+Daily stores of per-minute columns in pre-sized memory-mapped .npy files (np.lib.format.open_memmap), one file per UTC day
+with the 1440 minutes along one axis, and a per-minute presence mask next to it. A minute is written in place (the data
+first, then its presence flag), and a whole day is read with a single slice of the memory map.
+
+LineIntensityStore: float32 intensities of the calibrated spectral bands (spectral_calibration.py) at full spatial
+resolution, read as (bands, spatial pixels, 1440 minutes), for analysis and re-rendering without going back to the
+spectrograms. On disk the minutes are the first axis, so the minute written each minute is one contiguous block of a few kB
+instead of a 4-byte write in every row of the file; read_day() returns the transposed view (no copy).
+
+RGBColumnStore: the 8-bit (300, 3) RGB-columns of the column engine, replacing the 1440 PNG files of a day. Stored
+(1440, 300, 3) for the same reason; read_day() returns the (300, 1440, 3) keogram view, so assembling a keogram is one
+slice of the memory map.
+
+Files of a day (yyyy/mm/dd under the base folder): MISS2-<name>-yyyymmdd.npy, MISS2-<name>-yyyymmdd-presence.npy and
+MISS2-<name>-yyyymmdd.json (description of the axes, e.g. band names and wavelengths).
+
+'''
+
+import os
+import json
+import datetime
+import numpy as np
+
+minutes_per_day = 1440
+
+
+# Minute of the UTC day of a datetime (0 ... 1439)
+def minute_index(time):
+    return time.hour * 60 + time.minute
+
+
+class DailyColumnStore:
+    # base_folder: directory of the stores, name: kind of store (in the file names), dtype/fill_value: of the data,
+    # minute_axis: position of the minute axis in the array of a day
+    def __init__(self, base_folder, name, dtype, fill_value, minute_axis):
+        self.base_folder = base_folder
+        self.name = name
+        self.dtype = np.dtype(dtype)
+        self.fill_value = fill_value
+        self.minute_axis = minute_axis
+        self._open_day = None  # (date, data memmap, presence memmap) of the day written last
+
+    def path(self, date, suffix=".npy"):
+        return os.path.join(self.base_folder, date.strftime("%Y"), date.strftime("%m"), date.strftime("%d"),
+                            f"MISS2-{self.name}-{date:%Y%m%d}{suffix}")
+
+    # Shape of the array of a day for columns of cell_shape
+    def day_shape(self, cell_shape):
+        shape = list(cell_shape)
+        shape.insert(self.minute_axis if self.minute_axis >= 0 else len(shape) + 1 + self.minute_axis, minutes_per_day)
+        return tuple(shape)
+
+    def exists(self, date):
+        return os.path.exists(self.path(date)) and os.path.exists(self.path(date, "-presence.npy"))
+
+    # Create the files of a day (filled with fill_value, nothing present)
+    def create(self, date, cell_shape, metadata=None):
+        os.makedirs(os.path.dirname(self.path(date)), exist_ok=True)
+        data = np.lib.format.open_memmap(self.path(date), mode="w+", dtype=self.dtype, shape=self.day_shape(cell_shape))
+        data[...] = self.fill_value
+        data.flush()
+        presence = np.lib.format.open_memmap(self.path(date, "-presence.npy"), mode="w+", dtype=np.uint8, shape=(minutes_per_day,))
+        presence.flush()
+        temporary_path = self.path(date, ".json.tmp")
+        with open(temporary_path, "w") as f:
+            json.dump({"cell_shape": list(cell_shape), "dtype": self.dtype.str, "minute_axis": self.minute_axis, **(metadata or {})}, f, indent=1)
+        os.replace(temporary_path, self.path(date, ".json"))
+        return data, presence
+
+    # Open a day for writing, created if needed. Returns (data, presence) memmaps, None if the day exists with another shape.
+    def open_for_writing(self, date, cell_shape, metadata=None):
+        if self._open_day is not None and self._open_day[0] == date:
+            return self._open_day[1], self._open_day[2]
+        self.close()
+
+        if self.exists(date):
+            data = np.lib.format.open_memmap(self.path(date), mode="r+")
+            presence = np.lib.format.open_memmap(self.path(date, "-presence.npy"), mode="r+")
+            if data.shape != self.day_shape(cell_shape):
+                print(f"{self.path(date)} holds columns of another shape {data.shape}, expected {self.day_shape(cell_shape)}")
+                return None
+        else:
+            data, presence = self.create(date, cell_shape, metadata)
+        self._open_day = (date, data, presence)
+        return data, presence
+
+    # Write the columns of some minutes of a day. columns: [(minute (datetime or index), column of cell_shape)],
+    # flag: value of their presence mask (1, or a store-specific state)
+    def write_minutes(self, date, columns, metadata=None, flag=1):
+        if not columns:
+            return
+        opened = self.open_for_writing(date, np.shape(columns[0][1]), metadata)
+        if opened is None:
+            return
+        data, presence = opened
+        index = [slice(None)] * data.ndim
+        minutes = []
+        for minute, column in columns:
+            minute = minute if isinstance(minute, (int, np.integer)) else minute_index(minute)
+            index[self.minute_axis] = minute
+            data[tuple(index)] = column
+            minutes.append(minute)
+        data.flush()
+        presence[minutes] = flag  # Flagged once the data is on disk
+        presence.flush()
+
+    def write(self, time, column, metadata=None):
+        self.write_minutes(time.date() if isinstance(time, datetime.datetime) else time, [(time, column)], metadata)
+
+    # Read-only views of a day: (data, presence, metadata), None if the day has no store
+    def read_day(self, date):
+        if not self.exists(date):
+            return None
+        data = np.lib.format.open_memmap(self.path(date), mode="r")
+        presence = np.lib.format.open_memmap(self.path(date, "-presence.npy"), mode="r")
+        try:
+            with open(self.path(date, ".json")) as f:
+                metadata = json.load(f)
+        except (OSError, ValueError):
+            metadata = {}
+        return data, presence, metadata
+
+    def close(self):
+        if self._open_day is not None:
+            self._open_day[1].flush()
+            self._open_day[2].flush()
+            self._open_day = None
+
+
+class LineIntensityStore(DailyColumnStore):
+    # Intensities of the calibrated bands, stored (1440, bands, spatial pixels) float32, NaN where a minute is missing
+    def __init__(self, base_folder):
+        super().__init__(base_folder, "lines", np.float32, np.nan, minute_axis=0)
+
+    # Write the (bands, spatial pixels) intensities of some minutes of a day, with the names and wavelengths of the bands
+    def write_intensities(self, date, intensities_by_minute, names, wavelengths):
+        metadata = {"axes": ["minute", "band", "spatial"], "names": list(names), "wavelengths_nm": [float(w) for w in wavelengths]}
+        self.write_minutes(date, intensities_by_minute, metadata)
+
+    # (bands, spatial pixels, 1440) view of a day, presence mask and metadata, None if the day has no store
+    def read_day(self, date):
+        day = super().read_day(date)
+        if day is None:
+            return None
+        data, presence, metadata = day
+        return data.transpose(1, 2, 0), presence, metadata
+
+
+class RGBColumnStore(DailyColumnStore):
+    # 8-bit RGB-columns, stored (1440, height, 3), white (255) where a minute is missing
+    def __init__(self, base_folder):
+        super().__init__(base_folder, "RGB", np.uint8, 255, minute_axis=0)
+
+    # Write the (height, 1, 3) RGB-columns of some minutes of a day
+    def write_columns(self, date, columns_by_minute):
+        self.write_minutes(date, [(minute, column.reshape(column.shape[0], 3)) for minute, column in columns_by_minute],
+                           {"axes": ["minute", "row", "channel"]})
+
+    # (height, 1440, 3) keogram view of a day, presence mask and metadata, None if the day has no store
+    def read_day(self, date):
+        day = super().read_day(date)
+        if day is None:
+            return None
+        data, presence, metadata = day
+        return data.transpose(1, 0, 2), presence, metadata
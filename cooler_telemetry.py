@@ -0,0 +1,101 @@
+'''
+Background sampling of the Atik 414EX cooler telemetry (sensor temperature, cooling power from cooling_info and window
+heater power). Samples are taken at their own rate into a small ring buffer, so the capture path only reads the latest cached
+value instead of querying the SDK for every frame, and are logged to one CSV file per night for trend analysis.
+
+'''
+
+import os
+import csv
+import threading
+import datetime
+from collections import deque
+
+
+# Observation nights span midnight: a night is named after the UTC date of its evening (noon to noon)
+def night_date(utc_time):
+    return (utc_time - datetime.timedelta(hours=12)).strftime("%Y%m%d")
+
+# cooling_info comes back from the SDK as a tuple/dict depending on the version, store it as one "k=v;..." CSV field
+def format_cooling_info(cooling_info):
+    if isinstance(cooling_info, dict):
+        return ";".join(f"{key}={value}" for key, value in cooling_info.items())
+    if isinstance(cooling_info, (tuple, list)):
+        return ";".join(str(value) for value in cooling_info)
+    return str(cooling_info)
+
+
+class CoolerTelemetry:
+    # interval: seconds between two samples, history: number of samples kept in memory
+    # camera_lock (optional): lock shared with the capture code if the SDK must not be called from two threads at once
+    def __init__(self, camera, log_folder, interval=10.0, history=360, camera_lock=None):
+        self.camera = camera
+        self.log_folder = log_folder
+        self.interval = interval
+        self.samples = deque(maxlen=history)
+        self.camera_lock = camera_lock or threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        os.makedirs(self.log_folder, exist_ok=True)
+        self._sample()  # First value available before the first frame
+        self._thread = threading.Thread(target=self._run, name="CoolerTelemetry", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    # Query the SDK once, a failing query only blanks its own field
+    def _query(self, function):
+        try:
+            with self.camera_lock:
+                return function()
+        except Exception as e:
+            print(f"Could not retrieve telemetry ({function.__name__}): {e}")
+            return None
+
+    def _sample(self):
+        sample = {
+            "time": datetime.datetime.now(datetime.timezone.utc),
+            "temperature": self._query(self.camera.get_temperature),
+            "cooling_info": self._query(self.camera.cooling_info),
+            "window_heater_power": self._query(self.camera.get_window_heater_power),
+        }
+        self.samples.append(sample)
+        print("Current temperature:", sample["temperature"])
+        self._log(sample)
+
+    def _log(self, sample):
+        log_path = os.path.join(self.log_folder, f"telemetry-MISS2-{night_date(sample['time'])}.csv")
+        new_file = not os.path.exists(log_path)
+        try:
+            with open(log_path, "a", newline="") as log_file:
+                writer = csv.writer(log_file)
+                if new_file:
+                    writer.writerow(["UTC time", "Temperature (C)", "Cooling info", "Window heater power"])
+                writer.writerow([
+                    sample["time"].strftime("%Y-%m-%dT%H:%M:%S"),
+                    "" if sample["temperature"] is None else sample["temperature"],
+                    "" if sample["cooling_info"] is None else format_cooling_info(sample["cooling_info"]),
+                    "" if sample["window_heater_power"] is None else sample["window_heater_power"],
+                ])
+        except OSError as e:
+            print(f"Could not write telemetry log {log_path}: {e}")
+
+    # Latest sample (dict) or None
+    def latest(self):
+        return self.samples[-1] if self.samples else None
+
+    # Latest sensor temperature, "Unknown" if it could not be read
+    def latest_temperature(self):
+        sample = self.latest()
+        if sample is None or sample["temperature"] is None:
+            return "Unknown"
+        return sample["temperature"]
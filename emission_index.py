@@ -0,0 +1,181 @@
+'''
+Per-minute index of the emission line intensities in SQLite, written by the column engine (RGB_column_engine.py) with the
+RGB-columns, so that bright 557.7 nm or 630.0 nm events can be found over a whole season by a query instead of by looking
+at keograms.
+
+For every minute with data, and every emission line of the RGB-columns (630.0, 557.7, 427.8 nm), the mean and maximum of the
+background-subtracted line profile (counts) over the whole spatial range and over zenith-angle bands (south, zenith, north,
+the spatial range mapped linearly from 90 deg S to 90 deg N like the keogram axis). The flags of a minute mark the lines
+whose rows are saturated in the averaged spectrogram (bit i for the i-th line).
+
+Schema (minute: minutes since 1970-01-01 00:00 UT):
+- minutes(minute INTEGER PRIMARY KEY, flags INTEGER): one row per minute with data (coverage)
+- line_stats(line REAL, band TEXT, minute INTEGER, mean REAL, max REAL), keyed by (line, band, minute) with an index on
+  (line, band, max), so a date range or a threshold on the maximum is a range scan of one index
+
+Example: python emission_index.py --line 557.7 --max-above 5000 --start 2024/01/01 --end 2024/03/31
+
+'''
+
+import os
+import math
+import sqlite3
+import argparse
+import datetime
+import numpy as np
+
+emission_index_path = r'C:\Users\auroras\.venvMISS2\MISS2\emission_index.sqlite'  # Index written by the column engine
+
+line_wavelengths = (630.0, 557.7, 427.8)  # Emission lines of the RGB-columns, in red, green, blue order
+zenith_bands = {"south": (-90, -30), "zenith": (-30, 30), "north": (30, 90)}  # Zenith-angle bands (degrees, south negative)
+saturation_level = 65000  # Counts from which a pixel of the averaged spectrogram is taken as saturated
+
+epoch = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+
+schema = """
+CREATE TABLE IF NOT EXISTS minutes (minute INTEGER PRIMARY KEY, flags INTEGER NOT NULL);
+CREATE TABLE IF NOT EXISTS line_stats (line REAL NOT NULL, band TEXT NOT NULL, minute INTEGER NOT NULL, mean REAL NOT NULL,
+                                       max REAL NOT NULL, PRIMARY KEY (line, band, minute)) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS line_stats_max ON line_stats (line, band, max);
+"""
+
+
+# Minutes since the epoch of a UTC datetime (naive datetimes are taken as UTC), and back
+def minute_number(time):
+    if time.tzinfo is None:
+        time = time.replace(tzinfo=datetime.timezone.utc)
+    return int((time - epoch).total_seconds() // 60)
+
+def minute_time(minute):
+    return epoch + datetime.timedelta(minutes=minute)
+
+
+class EmissionIndex:
+    # path: SQLite database (created if needed), wavelengths: lines of the profiles, in their order
+    def __init__(self, path=emission_index_path, wavelengths=line_wavelengths, zenith_bands=zenith_bands):
+        self.path = path
+        self.wavelengths = tuple(wavelengths)
+        self.zenith_bands = zenith_bands
+        self._masks = {}  # number of spatial pixels -> [(band, pixel mask)]
+        self.connection = None  # Opened (and the database created) at the first use
+
+    def connect(self):
+        if self.connection is None:
+            if os.path.dirname(self.path):
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self.connection = sqlite3.connect(self.path, timeout=60)  # The backfill processes write one day at a time
+            self.connection.execute("PRAGMA journal_mode=WAL")  # Queries do not wait for the writer
+            self.connection.executescript(schema)
+        return self.connection
+
+    # Spatial pixels of each band for profiles of this width
+    def band_masks(self, width):
+        if width not in self._masks:
+            zenith_angles = -90 + 180 * (np.arange(width) + 0.5) / width
+            self._masks[width] = [("all", np.ones(width, dtype=bool))] + [
+                (band, (zenith_angles >= low) & (zenith_angles < high)) for band, (low, high) in self.zenith_bands.items()]
+        return self._masks[width]
+
+    # Index the minutes of some averaged spectrograms. times: UTC datetimes of the minutes, profiles: (frames, lines,
+    # columns) from EmissionLineExtractor.profiles, frame_bands: their band rows (EmissionLineExtractor.bands) for the
+    # saturation flags. A minute indexed again is replaced.
+    def add_minutes(self, times, profiles, frame_bands=None):
+        minutes = [minute_number(time) for time in times]
+        minute_rows = []
+        for i, minute in enumerate(minutes):
+            flags = 0
+            if frame_bands is not None:
+                for line, band_rows in enumerate(frame_bands[i]):
+                    if band_rows.size and band_rows.max() >= saturation_level:
+                        flags |= 1 << line
+            minute_rows.append((minute, flags))
+
+        # Mean and maximum of every band of every line of all the frames at once: (frames, lines). A line without data (its
+        # rows outside the frame, e.g. rows of full frames on binned ones) has a NaN profile and no statistics.
+        stat_rows = []
+        for band, mask in self.band_masks(profiles.shape[2]):
+            if not mask.any():
+                continue
+            means = profiles[:, :, mask].mean(axis=2).tolist()
+            maxima = profiles[:, :, mask].max(axis=2).tolist()
+            for line, wavelength in enumerate(self.wavelengths):
+                stat_rows.extend((wavelength, band, minute, frame_means[line], frame_maxima[line])
+                                 for minute, frame_means, frame_maxima in zip(minutes, means, maxima)
+                                 if math.isfinite(frame_means[line]) and math.isfinite(frame_maxima[line]))
+
+        connection = self.connect()
+        with connection:
+            connection.executemany("INSERT OR REPLACE INTO minutes VALUES (?, ?)", minute_rows)
+            connection.executemany("INSERT OR REPLACE INTO line_stats VALUES (?, ?, ?, ?, ?)", stat_rows)
+
+    # Wavelength of the indexed line nearest to line (nm)
+    def indexed_line(self, line):
+        wavelength = min(self.wavelengths, key=lambda wavelength: abs(wavelength - line))
+        if abs(wavelength - line) > 0.5:
+            raise ValueError(f"No line at {line} nm in the emission index")
+        return wavelength
+
+    # Minutes where the statistic ("max" or "mean") of a line in a zenith-angle band is above a threshold, between start and
+    # end (UTC datetimes, included). Returns [(datetime, mean, max, flags)] in time order.
+    def find_minutes(self, line, above, start=None, end=None, statistic="max", band="all"):
+        if statistic not in ("max", "mean"):
+            raise ValueError(f"Unknown statistic {statistic}")
+        connection = self.connect()
+        line = self.indexed_line(line)
+        first = minute_number(start) if start is not None else 0
+        last = minute_number(end) if end is not None else 2**62
+
+        # A threshold on the maximum scans the index on max from the threshold if fewer minutes are above it (in all the
+        # index) than in the date range, which is the case of events; otherwise (and for the mean) the date range is scanned.
+        # SQLite's planner always takes the date range, it cannot tell how rare the minutes above the threshold are.
+        index = "line_stats_max" if statistic == "max" else None
+        if index is not None and end is not None and start is not None:
+            above_count = connection.execute("""SELECT COUNT(*) FROM (SELECT 1 FROM line_stats INDEXED BY line_stats_max
+                                                WHERE line = ? AND band = ? AND max > ? LIMIT ?)""",
+                                             (line, band, above, last - first + 1)).fetchone()[0]
+            if above_count > last - first:
+                index = None
+        rows = connection.execute(
+            f"""SELECT s.minute, s.mean, s.max, m.flags FROM line_stats AS s {f"INDEXED BY {index}" if index else ""}
+                JOIN minutes AS m ON m.minute = s.minute
+                WHERE s.line = ? AND s.band = ? AND s.minute BETWEEN ? AND ? AND s.{statistic} > ? ORDER BY s.minute""",
+            (line, band, first, last, above)).fetchall()
+        return [(minute_time(minute), mean, maximum, flags) for minute, mean, maximum, flags in rows]
+
+    # Number of minutes with data between start and end (UTC datetimes, included)
+    def count_minutes(self, start, end):
+        return self.connect().execute("SELECT COUNT(*) FROM minutes WHERE minute BETWEEN ? AND ?",
+                                      (minute_number(start), minute_number(end))).fetchone()[0]
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+
+def parse_date(date_string):
+    return datetime.datetime.strptime(date_string, "%Y/%m/%d").replace(tzinfo=datetime.timezone.utc)
+
+def main():
+    parser = argparse.ArgumentParser(description="Find the minutes of bright emissions in the MISS2 emission index.")
+    parser.add_argument("--line", type=float, required=True, help="Emission line (nm), e.g. 557.7")
+    parser.add_argument("--max-above", type=float, help="Minutes whose maximum (counts) is above this value")
+    parser.add_argument("--mean-above", type=float, help="Minutes whose mean (counts) is above this value")
+    parser.add_argument("--band", default="all", choices=["all", *zenith_bands], help="Zenith-angle band")
+    parser.add_argument("--start", type=parse_date, help="First day (yyyy/mm/dd)")
+    parser.add_argument("--end", type=parse_date, help="Last day (yyyy/mm/dd, included)")
+    parser.add_argument("--index", default=emission_index_path, help="SQLite emission index")
+    args = parser.parse_args()
+    if (args.max_above is None) == (args.mean_above is None):
+        parser.error("give one of --max-above and --mean-above")
+
+    index = EmissionIndex(args.index)
+    end = args.end + datetime.timedelta(days=1, minutes=-1) if args.end else None
+    statistic, above = ("max", args.max_above) if args.max_above is not None else ("mean", args.mean_above)
+    minutes = index.find_minutes(args.line, above, args.start, end, statistic, args.band)
+    for time, mean, maximum, flags in minutes:
+        print(f"{time:%Y-%m-%d %H:%M}  mean {mean:10.1f}  max {maximum:10.1f}{'  saturated' if flags else ''}")
+    print(f"{len(minutes)} minutes")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+'''
+Batched extraction of the auroral emission lines from many averaged spectrograms at once (e.g. a whole night), producing
+the same RGB-columns as the column makers in one vectorised pass instead of one medfilt2d call per line per image.
+
+Only the rows of the emission bands are kept from each decoded spectrogram, so a night of 1440 minutes holds a few MB.
+For each band the 3x3 median filter runs once on the (frames, rows, columns) stack (scipy.ndimage with zero padding, like
+medfilt2d), the background is the mean of the first background_columns columns of the filtered band, and the columns of
+all the frames are resized to 300 pixels in a single PIL call.
+
+'''
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from PIL import Image
+from scipy import ndimage
+
+
+class EmissionLineExtractor:
+    # rows: centre row of each emission line, south_column/north_column: spatial range kept (None for the whole width),
+    # background_columns: columns used for the background (as process_image: [0:30, 0:30] of the band)
+    def __init__(self, rows, south_column=None, north_column=None, background_columns=30):
+        self.rows = list(rows)
+        self.column_slice = slice(south_column, north_column)
+        self.background_columns = background_columns
+
+    # Row indices of each band (row - 1 and row, clipped to the frame, as process_emission_line)
+    def band_rows(self, height):
+        return [np.arange(max(row - 1, 0), min(row + 1, height)) for row in self.rows]
+
+    # Rows of each band of one spectrogram, [(band rows, columns)]
+    def bands(self, spectro_array):
+        return [spectro_array[band_rows, self.column_slice] for band_rows in self.band_rows(spectro_array.shape[0])]
+
+    # Spatial profile of each emission line for a stack of band slices (one list per frame, from bands()).
+    # Returns a (frames, lines, columns) float32 array.
+    def profiles(self, frame_bands):
+        profiles = []
+        for line in range(len(self.rows)):
+            band_stack = np.stack([bands[line] for bands in frame_bands]).astype(np.float32)  # (frames, rows, columns)
+            filtered = ndimage.median_filter(band_stack, size=(1, 3, 3), mode="constant", cval=0.0)
+            background = filtered[:, :, :self.background_columns].mean(axis=(1, 2), dtype=np.float64).astype(np.float32)
+            filtered = np.maximum(0, filtered - background[:, None, None])
+            profiles.append(filtered.mean(axis=1))
+        return np.stack(profiles, axis=1)
+
+    # Profiles of whole spectrograms (frames, rows, columns)
+    def extract(self, spectro_stack):
+        return self.profiles([self.bands(spectro_array) for spectro_array in spectro_stack])
+
+
+# Scaling strategies: (frames, columns, 3) float32 intensities -> uint8
+
+# Fraction of the 16-bit full scale (normalised_RGB_column_maker)
+def normalised_scaling(RGB, full_scale=65535.0):
+    return (np.clip(RGB / full_scale, 0, 1) * 255).astype(np.uint8)
+
+# Counts cast directly to 8 bits (RGB_column_maker, past-RGB-column-maker)
+def counts_scaling(RGB):
+    return RGB.astype(np.uint8)
+
+# Square-root stretch of the normalised intensities, brings out the faint aurora next to bright arcs
+def sqrt_scaling(RGB, full_scale=65535.0):
+    return (np.sqrt(np.clip(RGB / full_scale, 0, 1)) * 255).astype(np.uint8)
+
+scalings = {"normalised": normalised_scaling, "counts": counts_scaling, "sqrt": sqrt_scaling}
+
+
+# 8-bit RGB-columns (frames, height, 1, 3) from the (frames, 3, columns) profiles in red, green, blue order.
+# scaling: name in scalings or a function (frames, columns, 3) float32 -> uint8
+def rgb_columns(profiles, factors=(1, 1, 1), scaling="normalised", height=300):
+    if isinstance(scaling, str):
+        scaling = scalings[scaling]
+    RGB = scaling(profiles.transpose(0, 2, 1) * np.asarray(factors, dtype=np.float32))  # (frames, columns, 3)
+
+    # All the frames side by side: the LANCZOS resize only works along the columns, like the resize of each column
+    side_by_side = Image.fromarray(np.ascontiguousarray(RGB.transpose(1, 0, 2)))
+    resized = np.array(side_by_side.resize((RGB.shape[0], height), Image.Resampling.LANCZOS))
+    return resized.transpose(1, 0, 2)[:, :, None, :]
+
+
+# Decode spectrograms (in a thread pool) keeping only what reduce(spectro_array) returns, e.g. the emission bands.
+# Returns the reduced frames that could be read and their paths; corrupted files are reported and skipped.
+def load_reduced(png_file_paths, reduce, threads=4):
+    def read_reduced(png_file_path):
+        try:
+            with Image.open(png_file_path) as img:
+                return reduce(np.array(img))
+        except Exception as e:
+            print(f"Corrupted raw PNG detected: {png_file_path} - {e}")
+            return None
+
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        results = list(pool.map(read_reduced, png_file_paths))
+    valid = [(path, reduced) for path, reduced in zip(png_file_paths, results) if reduced is not None]
+    return [reduced for _, reduced in valid], [path for path, _ in valid]
+
+# Name of the RGB-column of an averaged spectrogram (seconds replaced by 00, as make_rgb_column)
+def column_filename(png_file_path):
+    return f"{os.path.basename(png_file_path)[:-6]}00.png"
+
+# Save the RGB-columns (from rgb_columns()) of the spectrograms in output_folder. Returns the paths of the columns.
+def save_rgb_columns(columns, png_file_paths, output_folder):
+    os.makedirs(output_folder, exist_ok=True)
+    output_paths = []
+    for png_file_path, column in zip(png_file_paths, columns):
+        output_path = os.path.join(output_folder, column_filename(png_file_path))
+        Image.fromarray(column).save(output_path)
+        output_paths.append(output_path)
+    print(f"Saved {len(output_paths)} RGB column images in {output_folder}")
+    return output_paths
+
+# RGB-columns of many averaged spectrograms in one pass, saved in output_folder. Returns the paths of the columns saved.
+# rows: (row_630, row_558, row_428) as in the column makers.
+def make_rgb_columns(png_file_paths, output_folder, rows, south_column=None, north_column=None, factors=(1, 1, 1),
+                     scaling="normalised", threads=4):
+    extractor = EmissionLineExtractor(rows, south_column, north_column)
+    frame_bands, valid_paths = load_reduced(png_file_paths, extractor.bands, threads)
+    if not valid_paths:
+        return []
+    return save_rgb_columns(rgb_columns(extractor.profiles(frame_bands), factors, scaling), valid_paths, output_folder)
@@ -0,0 +1,181 @@
+'''
+Shared-memory frame bus between capture_Atik.py and the processing scripts. The capture publishes every frame (and every
+minute average) into a small ring in multiprocessing.shared_memory, each slot with a header (sequence number, UTC time,
+exposure, temperature, binning), and the other scripts read the newest frames from it without disk I/O or PNG decoding.
+
+Layout: bus header (uint64 x 8) | slot headers (slot_header_dtype x slots) | frames (uint16 x slots x rows x columns)
+
+'''
+
+import time
+import datetime
+import numpy as np
+from multiprocessing import shared_memory
+
+bus_magic = 0x4D49535332425553  # "MISS2BUS"
+bus_version = 1
+
+# Names of the buses published by capture_Atik.py
+frames_bus_name = "MISS2_frames"
+minutes_bus_name = "MISS2_minutes"
+
+# A slot is being written while seq_begin != seq_end (seqlock)
+slot_header_dtype = np.dtype([
+    ("seq_begin", np.uint64),
+    ("seq_end", np.uint64),
+    ("timestamp", np.float64),  # UTC, seconds since the epoch
+    ("exposure", np.float64),  # Seconds
+    ("temperature", np.float64),  # Celsius, NaN if unknown
+    ("binX", np.uint32),
+    ("binY", np.uint32),
+])
+
+bus_header_size = 8 * 8
+
+
+def _views(shm, slots, shape):
+    header = np.ndarray((8,), dtype=np.uint64, buffer=shm.buf)
+    slot_headers = np.ndarray((slots,), dtype=slot_header_dtype, buffer=shm.buf, offset=bus_header_size)
+    data = np.ndarray((slots,) + tuple(shape), dtype=np.uint16, buffer=shm.buf,
+                      offset=bus_header_size + slots * slot_header_dtype.itemsize)
+    return header, slot_headers, data
+
+def _attach(name):
+    # Readers must not let the resource tracker remove the segment when they exit (Python < 3.13 on POSIX)
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        from multiprocessing import resource_tracker
+        register = resource_tracker.register
+        resource_tracker.register = lambda *args, **kwargs: None
+        try:
+            return shared_memory.SharedMemory(name=name)
+        finally:
+            resource_tracker.register = register
+
+
+class FrameBusPublisher:
+    # shape: (rows, columns) of the frames, slots: number of frames kept in the ring
+    def __init__(self, name, shape, slots=4):
+        self.name = name
+        self.shape = tuple(shape)
+        self.slots = slots
+        size = bus_header_size + slots * slot_header_dtype.itemsize + slots * self.shape[0] * self.shape[1] * 2
+        try:
+            self.shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        except FileExistsError:
+            # Left over by a capture that did not exit cleanly
+            stale = shared_memory.SharedMemory(name=name)
+            stale.close()
+            stale.unlink()
+            self.shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+
+        self.header, self.slot_headers, self.data = _views(self.shm, slots, self.shape)
+        self.slot_headers[:] = 0
+        self.header[:] = [bus_magic, bus_version, slots, self.shape[0], self.shape[1], 0, 0, 0]
+        self.seq = 0
+
+    # Publish a frame, timestamp is a UTC datetime and temperature may be "Unknown"
+    def publish(self, array, timestamp, exposure, temperature, binX, binY):
+        if array.shape != self.shape:
+            print(f"Frame of shape {array.shape} not published on {self.name} (expects {self.shape})")
+            return
+        self.seq += 1
+        slot_header = self.slot_headers[self.seq % self.slots]
+        slot_header["seq_begin"] = self.seq  # Readers detect the slot as being overwritten from here on
+        np.copyto(self.data[self.seq % self.slots], array, casting="unsafe")
+        slot_header["timestamp"] = timestamp.timestamp()
+        slot_header["exposure"] = exposure
+        slot_header["temperature"] = temperature if isinstance(temperature, (int, float)) else np.nan
+        slot_header["binX"] = binX
+        slot_header["binY"] = binY
+        slot_header["seq_end"] = self.seq
+        self.header[5] = self.seq  # Latest sequence number
+
+    def close(self):
+        del self.header, self.slot_headers, self.data
+        self.shm.close()
+        try:
+            self.shm.unlink()
+        except FileNotFoundError:
+            pass
+
+
+class FrameBusSubscriber:
+    # Raises FileNotFoundError if nobody publishes on this bus (yet)
+    def __init__(self, name):
+        self.name = name
+        self.shm = _attach(name)
+        header = np.ndarray((8,), dtype=np.uint64, buffer=self.shm.buf)
+        if header[0] != bus_magic or header[1] != bus_version:
+            self.shm.close()
+            raise ValueError(f"Shared memory {name} is not a MISS2 frame bus")
+        self.slots = int(header[2])
+        self.shape = (int(header[3]), int(header[4]))
+        self.header, self.slot_headers, self.data = _views(self.shm, self.slots, self.shape)
+
+    def latest_seq(self):
+        return int(self.header[5])
+
+    # Copy of frame number seq with its header (dict), None if it is not (or no longer) in the ring
+    def read(self, seq, retries=3):
+        for _ in range(retries):
+            slot_header = self.slot_headers[seq % self.slots]
+            if int(slot_header["seq_end"]) != seq:
+                return None
+            info = {
+                "seq": seq,
+                "time": datetime.datetime.fromtimestamp(float(slot_header["timestamp"]), datetime.timezone.utc),
+                "exposure": float(slot_header["exposure"]),
+                "temperature": float(slot_header["temperature"]),
+                "binning": (int(slot_header["binX"]), int(slot_header["binY"])),
+            }
+            frame = self.data[seq % self.slots].copy()
+            # Valid only if the publisher did not start rewriting the slot during the copy
+            if int(slot_header["seq_begin"]) == seq:
+                return info, frame
+        return None
+
+    # Newest frame (header, array), None if nothing has been published yet
+    def latest(self):
+        for _ in range(3):
+            seq = self.latest_seq()
+            if seq == 0:
+                return None
+            frame = self.read(seq)
+            if frame is not None:
+                return frame
+        return None
+
+    # Frames newer than last_seq that are still in the ring, oldest first
+    def frames_since(self, last_seq):
+        latest = self.latest_seq()
+        for seq in range(max(last_seq + 1, latest - self.slots + 1, 1), latest + 1):
+            frame = self.read(seq)
+            if frame is not None:
+                yield frame
+
+    # Wait (polling) for a frame newer than last_seq, None on timeout
+    def wait_for_new(self, last_seq, timeout=None, poll_interval=0.05):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self.latest_seq() <= last_seq:
+            if deadline is not None and time.monotonic() > deadline:
+                return None
+            time.sleep(poll_interval)
+        return self.latest()
+
+    def close(self):
+        del self.header, self.slot_headers, self.data
+        self.shm.close()
+
+
+# Newest frame of a bus in one call (attach, copy, detach), None if the bus does not exist or is empty
+def read_latest_frame(name):
+    try:
+        subscriber = FrameBusSubscriber(name)
+    except (FileNotFoundError, ValueError):
+        return None
+    try:
+        return subscriber.latest()
+    finally:
+        subscriber.close()
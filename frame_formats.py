@@ -0,0 +1,88 @@
+'''
+Writers and readers of the raw MISS2 frames in the supported formats: PNG with a tunable zlib compression level (metadata in
+text chunks), uncompressed FITS (exposure, temperature, binning and time in the header) and raw NumPy .npy (fastest, no
+metadata). The capture writes with save_frame_file(), the averaging and analysis scripts read any of them with read_frame().
+
+'''
+
+import os
+import datetime
+import numpy as np
+from PIL import Image, PngImagePlugin
+
+# File extension of each raw format
+frame_extensions = {"png": ".png", "fits": ".fits", "npy": ".npy"}
+
+
+# Save a 16-bit frame as PNG with its metadata stored as text chunks (compress_level: 0 = none ... 9 = smallest)
+def save_png_frame(image_path, uint16_array, metadata, compress_level=6):
+    png_info = PngImagePlugin.PngInfo()
+    for key, value in metadata.items():
+        png_info.add_text(key, str(value))
+
+    img = Image.fromarray(uint16_array)
+    img.save(image_path, "PNG", pnginfo=png_info, compress_level=compress_level)
+
+# Translate the capture metadata (text values, see capture_Atik.build_metadata) into standard FITS keywords
+def fits_header_from_metadata(metadata):
+    from astropy.io import fits
+
+    header = fits.Header()
+    for key, value in metadata.items():
+        value = str(value)
+        try:
+            if key == "Exposure Time":
+                header["EXPTIME"] = (float(value.split()[0]), "Exposure time (s)")
+            elif key == "Temperature":
+                header["CCD-TEMP"] = (float(value.split()[0]), "Sensor temperature (C)")
+            elif key == "Binning":
+                binX, binY = value.split("x")
+                header["XBINNING"] = (int(binX), "Horizontal binning")
+                header["YBINNING"] = (int(binY), "Vertical binning")
+            elif key == "Date/Time":
+                time_format = "%Y%m%d-%H%M%S-%f" if value.count("-") == 2 else "%Y%m%d-%H%M%S"
+                header["DATE-OBS"] = (datetime.datetime.strptime(value, time_format).isoformat(timespec="milliseconds"), "UTC")
+            elif key == "Averaged frames":
+                header["NCOMBINE"] = (int(value), "Number of frames averaged")
+            else:
+                header["HIERARCH " + key] = value
+        except ValueError:
+            # e.g. "Unknown C" when the temperature could not be read
+            continue
+    header["INSTRUME"] = "MISS2"
+    return header
+
+# Save a 16-bit frame as uncompressed FITS (astropy), the metadata goes into the header
+def save_fits_frame(image_path, uint16_array, metadata):
+    from astropy.io import fits
+
+    hdu = fits.PrimaryHDU(data=np.ascontiguousarray(uint16_array), header=fits_header_from_metadata(metadata))
+    hdu.writeto(image_path, overwrite=True)
+
+# Save a 16-bit frame as a raw NumPy array (no metadata). Written through a file object, np.save would otherwise append
+# .npy to a temporary name
+def save_npy_frame(image_path, uint16_array, metadata):
+    with open(image_path, "wb") as f:
+        np.save(f, uint16_array)
+
+# Saving function for a raw format, with the signature expected by FrameWriter: f(image_path, uint16_array, metadata)
+def frame_saver(raw_format, png_compress_level=6):
+    if raw_format == "png":
+        return lambda image_path, uint16_array, metadata: save_png_frame(image_path, uint16_array, metadata, png_compress_level)
+    if raw_format == "fits":
+        return save_fits_frame
+    if raw_format == "npy":
+        return save_npy_frame
+    raise ValueError(f"Unknown raw frame format: {raw_format} (expected one of {', '.join(frame_extensions)})")
+
+# Read a frame saved in any of the supported formats as a 2-D uint16 array
+def read_frame(image_path):
+    extension = os.path.splitext(image_path)[1].lower()
+    if extension == ".fits":
+        from astropy.io import fits
+        with fits.open(image_path, memmap=False) as hdul:
+            return np.asarray(hdul[0].data, dtype=np.uint16)
+    if extension == ".npy":
+        return np.load(image_path)
+    with Image.open(image_path) as img:
+        return np.array(img)
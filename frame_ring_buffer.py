@@ -0,0 +1,60 @@
+'''
+Ring of preallocated 16-bit frame buffers for the capture. Each new frame is copied (and flipped) once into a free buffer,
+which the consumers (writer threads, stacking...) borrow without copying and give back when done, so the steady-state
+capture does not allocate any new frame array.
+
+'''
+
+import threading
+from collections import deque
+import numpy as np
+
+
+class FrameSlot:
+    def __init__(self, ring, index, array):
+        self.ring = ring
+        self.index = index
+        self.array = array
+        self.references = 0
+
+    # Borrow the buffer (e.g. before handing it over to another thread)
+    def retain(self):
+        with self.ring.lock:
+            self.references += 1
+
+    # Give the buffer back, it returns to the ring once nobody holds it anymore
+    def release(self):
+        with self.ring.lock:
+            self.references -= 1
+            if self.references == 0:
+                self.ring.free.append(self.index)
+
+
+class FrameRingBuffer:
+    # shape: (rows, columns) of the frames, e.g. (1039 // binY, 1391 // binX)
+    def __init__(self, shape, slots=8, dtype=np.uint16):
+        self.shape = tuple(shape)
+        self.lock = threading.Lock()
+        self.slots = [FrameSlot(self, i, np.empty(self.shape, dtype=dtype)) for i in range(slots)]
+        self.free = deque(range(slots))
+        self.exhausted = 0  # Number of times no buffer was free
+
+    # Take a free buffer (held once by the caller), None if all buffers are still borrowed
+    def acquire(self):
+        with self.lock:
+            if not self.free:
+                self.exhausted += 1
+                return None
+            slot = self.slots[self.free.popleft()]
+            slot.references = 1
+            return slot
+
+    # Copy a frame into a buffer, converting the dtype and flipping it vertically on the fly (no temporary arrays)
+    def fill(self, slot, image_array, flip=False):
+        source = image_array[::-1] if flip else image_array
+        np.copyto(slot.array, source, casting="unsafe")
+        return slot.array
+
+    def free_count(self):
+        with self.lock:
+            return len(self.free)
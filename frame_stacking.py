@@ -0,0 +1,181 @@
+'''
+Minute stacking of raw frames for average_PNG_maker.py. The frames of a minute are decoded concurrently in a thread pool (the
+zlib/PIL decoding releases the GIL) with a bounded number of frames in flight, and summed into an integer accumulator, which
+is exact and independent of the order in which the decodes complete. When catching up after downtime, many minutes are
+averaged at once in a process pool.
+
+The plain mean is identical to the original float64 loop: (sum / count).astype(uint16). The robust estimators (median,
+sigma-clipped mean, min/max rejection) reject cosmic rays and satellite glints; they work on the (n_frames, rows, columns)
+stack, processed in chunks of rows to cap the memory of the float32 temporaries, and can also return the per-pixel variance
+and number of frames kept.
+
+'''
+
+import os
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+
+import numpy as np
+from frame_formats import read_frame
+
+
+# Decode frames, in completion order, with at most max_in_flight decodes queued at once. Yields (path, array or exception).
+def decode_frames(filepaths, executor=None, max_in_flight=8):
+    if executor is None:
+        for filepath in filepaths:
+            try:
+                yield filepath, read_frame(filepath)
+            except Exception as e:
+                yield filepath, e
+        return
+
+    pending = {}
+    remaining = iter(filepaths)
+    for filepath in remaining:
+        pending[executor.submit(read_frame, filepath)] = filepath
+        if len(pending) >= max_in_flight:
+            break
+
+    while pending:
+        future = next(as_completed(pending))
+        filepath = pending.pop(future)
+        try:
+            yield filepath, future.result()
+        except Exception as e:
+            yield filepath, e
+        for filepath in remaining:
+            pending[executor.submit(read_frame, filepath)] = filepath
+            break
+
+# Integer sum of the frames that could be read (uint32 holds 65536 frames of 16 bits), and their number
+def sum_frames(filepaths, executor=None, max_in_flight=8):
+    sum_img_array = None
+    count = 0
+    for filepath, img_array in decode_frames(filepaths, executor, max_in_flight):
+        if isinstance(img_array, Exception):
+            print(f"Error processing image {os.path.basename(filepath)}: {img_array}")
+            continue
+        if sum_img_array is None:
+            sum_img_array = np.zeros(img_array.shape, dtype=np.uint32)
+        elif img_array.shape != sum_img_array.shape:
+            print(f"Error processing image {os.path.basename(filepath)}: shape {img_array.shape} differs from {sum_img_array.shape}")
+            continue
+        sum_img_array += img_array
+        count += 1
+    return sum_img_array, count
+
+# Average of the frames as uint16 (None if no frame could be read), and the number of frames averaged
+def average_frames(filepaths, executor=None, max_in_flight=8):
+    sum_img_array, count = sum_frames(filepaths, executor, max_in_flight)
+    if count == 0:
+        return None, 0
+    return (sum_img_array / count).astype(np.uint16), count
+
+
+stacking_methods = ("mean", "median", "sigma_clip", "minmax")
+
+
+# Decode all the frames of a minute into one (n_frames, rows, columns) uint16 stack, and the number of frames read
+def load_stack(filepaths, executor=None, max_in_flight=8):
+    stack = None
+    count = 0
+    for filepath, img_array in decode_frames(filepaths, executor, max_in_flight):
+        if isinstance(img_array, Exception):
+            print(f"Error processing image {os.path.basename(filepath)}: {img_array}")
+            continue
+        if stack is None:
+            stack = np.empty((len(filepaths),) + img_array.shape, dtype=np.uint16)
+        elif img_array.shape != stack.shape[1:]:
+            print(f"Error processing image {os.path.basename(filepath)}: shape {img_array.shape} differs from {stack.shape[1:]}")
+            continue
+        stack[count] = img_array
+        count += 1
+    return (None if stack is None else stack[:count]), count
+
+# Estimate of a chunk of rows of the stack (n, rows, columns). Returns the image (float32), the variance of the frames kept
+# and the number of frames kept per pixel.
+def _combine_chunk(chunk, method, sigma, iterations, reject):
+    data = chunk.astype(np.float32)
+    n = data.shape[0]
+
+    if method == "median":
+        return np.median(data, axis=0), data.var(axis=0), np.full(data.shape[1:], n, dtype=np.uint16)
+
+    if method == "minmax" and n > 2 * reject:
+        # Drop the reject lowest and highest values of each pixel
+        kept = np.sort(data, axis=0)[reject:n - reject]
+        return kept.mean(axis=0), kept.var(axis=0), np.full(data.shape[1:], n - 2 * reject, dtype=np.uint16)
+
+    if method == "sigma_clip" and n > 2:
+        # Reject the values further than sigma standard deviations from the median, repeated until nothing changes
+        mask = np.ones(data.shape, dtype=bool)
+        for _ in range(iterations):
+            masked = np.where(mask, data, np.nan)
+            center = np.nanmedian(masked, axis=0)
+            spread = np.nanstd(masked, axis=0)
+            new_mask = mask & (np.abs(data - center) <= sigma * spread)
+            if np.array_equal(new_mask, mask):
+                break
+            mask = new_mask
+        kept_count = np.maximum(mask.sum(axis=0), 1)
+        mean = np.where(mask, data, 0).sum(axis=0) / kept_count
+        variance = np.where(mask, (data - mean) ** 2, 0).sum(axis=0) / kept_count
+        return mean, variance, kept_count.astype(np.uint16)
+
+    # Mean (also for minmax / sigma_clip with too few frames to reject anything)
+    return data.mean(axis=0), data.var(axis=0), np.full(data.shape[1:], n, dtype=np.uint16)
+
+# Combine a (n_frames, rows, columns) stack with one of stacking_methods, chunk_rows rows at a time.
+# Returns the uint16 image, and the statistics {"variance": float32, "count": uint16} if statistics is True (else None).
+def combine_stack(stack, method="mean", sigma=3.0, iterations=3, reject=1, statistics=False, chunk_rows=64):
+    if method not in stacking_methods:
+        raise ValueError(f"Unknown stacking method: {method} (expected one of {', '.join(stacking_methods)})")
+
+    rows = stack.shape[1]
+    image = np.empty(stack.shape[1:], dtype=np.uint16)
+    variance = np.empty(stack.shape[1:], dtype=np.float32) if statistics else None
+    count = np.empty(stack.shape[1:], dtype=np.uint16) if statistics else None
+
+    for row in range(0, rows, chunk_rows):
+        rows_slice = slice(row, min(row + chunk_rows, rows))
+        chunk_image, chunk_variance, chunk_count = _combine_chunk(stack[:, rows_slice], method, sigma, iterations, reject)
+        image[rows_slice] = chunk_image  # Truncated to uint16, as the original mean
+        if statistics:
+            variance[rows_slice] = chunk_variance
+            count[rows_slice] = chunk_count
+
+    return image, ({"variance": variance, "count": count} if statistics else None)
+
+# Stack the frames of a minute. Returns the uint16 image (None if no frame could be read), the number of frames read and the
+# statistics (None unless requested). The plain mean without statistics is streamed and never holds the whole stack.
+def stack_frames(filepaths, executor=None, method="mean", sigma=3.0, iterations=3, reject=1, statistics=False,
+                 chunk_rows=64, max_in_flight=8):
+    if method == "mean" and not statistics:
+        averaged_image, count = average_frames(filepaths, executor, max_in_flight)
+        return averaged_image, count, None
+
+    stack, count = load_stack(filepaths, executor, max_in_flight)
+    if count == 0:
+        return None, 0, None
+    image, stack_statistics = combine_stack(stack, method, sigma, iterations, reject, statistics, chunk_rows)
+    return image, count, stack_statistics
+
+
+# Worker of the process pool: one minute, decoded sequentially (the parallelism is across minutes)
+def _stack_minute_job(job):
+    minute_key, filepaths, stack_options = job
+    image, count, stack_statistics = stack_frames(filepaths, **stack_options)
+    return minute_key, image, count, stack_statistics
+
+# Stack many minutes across a process pool. minute_jobs: [(minute_key, filepaths)], stack_options: keyword arguments of
+# stack_frames(). Yields (minute_key, image, count, statistics) as the minutes complete.
+# On Windows the calling script must run under if __name__ == "__main__".
+def stack_minutes(minute_jobs, processes=None, **stack_options):
+    with ProcessPoolExecutor(max_workers=processes) as pool:
+        futures = [pool.submit(_stack_minute_job, (minute_key, filepaths, stack_options)) for minute_key, filepaths in minute_jobs]
+        for future in as_completed(futures):
+            yield future.result()
+
+
+# Thread pool for decode_frames()
+def make_decode_pool(threads=4):
+    return ThreadPoolExecutor(max_workers=threads, thread_name_prefix="frame-decode")
@@ -0,0 +1,126 @@
+'''
+Background writer for the raw 16-bit frames captured by MISS2. Frames are handed over to a bounded queue and encoded/saved
+by one or more worker threads, so that PNG compression and disk access never hold back the next exposure.
+
+'''
+
+import os
+import queue
+import threading
+import time
+from frame_formats import save_png_frame
+
+
+# Save a frame with save_function under a temporary name in its directory and move it into place once complete, so a
+# process killed in the middle of a write never leaves a truncated frame where the averaging and analysis expect one
+def save_frame_atomically(save_function, image_path, uint16_array, metadata):
+    os.makedirs(os.path.dirname(image_path), exist_ok=True)
+    temporary_path = image_path + ".tmp"
+    try:
+        save_function(temporary_path, uint16_array, metadata)
+        os.replace(temporary_path, image_path)
+    except BaseException:
+        if os.path.exists(temporary_path):
+            os.remove(temporary_path)
+        raise
+
+
+class FrameWriter:
+    # num_threads: number of background writer threads (zlib releases the GIL, so more than one thread helps at high cadence)
+    # queue_size: number of frames allowed to wait for the writer before new frames are dropped
+    # put_timeout: seconds submit() may wait for room in the queue (back-pressure) before dropping the frame, 0 = never wait
+    def __init__(self, num_threads=1, queue_size=4, put_timeout=0.0, save_function=save_png_frame):
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.put_timeout = put_timeout
+        self.save_function = save_function
+
+        # Counters (read them through stats())
+        self.frames_submitted = 0
+        self.frames_written = 0
+        self.frames_dropped = 0
+        self.write_errors = 0
+        self.max_queue_depth = 0
+        self.total_write_time = 0.0
+        self.max_write_time = 0.0
+        self._lock = threading.Lock()
+
+        self._threads = []
+        for i in range(num_threads):
+            thread = threading.Thread(target=self._worker, name=f"FrameWriter-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    # Hand a frame over to the writer threads. Returns False if the frame had to be dropped because the queue is full.
+    # on_done (optional) is called once the frame has been written or dropped, e.g. to give a borrowed buffer back.
+    # wait=True blocks until there is room in the queue, for frames that must not be dropped (e.g. minute averages).
+    # save_function overrides the writer's default saving function (file format) for this frame.
+    def submit(self, image_path, uint16_array, metadata, on_done=None, wait=False, save_function=None):
+        job = (image_path, uint16_array, metadata, on_done, save_function or self.save_function)
+        try:
+            if wait:
+                self.queue.put(job)
+            elif self.put_timeout > 0:
+                self.queue.put(job, timeout=self.put_timeout)
+            else:
+                self.queue.put_nowait(job)
+        except queue.Full:
+            with self._lock:
+                self.frames_submitted += 1
+                self.frames_dropped += 1
+            print(f"Writer queue full, dropped image: {image_path}")
+            if on_done:
+                on_done()
+            return False
+
+        with self._lock:
+            self.frames_submitted += 1
+            self.max_queue_depth = max(self.max_queue_depth, self.queue.qsize())
+        return True
+
+    def _worker(self):
+        while True:
+            job = self.queue.get()
+            if job is None:  # Sentinel sent by close()
+                self.queue.task_done()
+                break
+
+            image_path, uint16_array, metadata, on_done, save_function = job
+            start = time.perf_counter()
+            try:
+                save_frame_atomically(save_function, image_path, uint16_array, metadata)
+                elapsed = time.perf_counter() - start
+                with self._lock:
+                    self.frames_written += 1
+                    self.total_write_time += elapsed
+                    self.max_write_time = max(self.max_write_time, elapsed)
+                print(f"Saved image: {image_path}")
+            except Exception as e:
+                with self._lock:
+                    self.write_errors += 1
+                print(f"Error saving image {image_path}: {e}")
+            finally:
+                if on_done:
+                    on_done()
+                self.queue.task_done()
+
+    # Snapshot of the writer counters
+    def stats(self):
+        with self._lock:
+            mean_write_time = self.total_write_time / self.frames_written if self.frames_written else 0.0
+            return {
+                "submitted": self.frames_submitted,
+                "written": self.frames_written,
+                "dropped": self.frames_dropped,
+                "errors": self.write_errors,
+                "queued": self.queue.qsize(),
+                "max_queue_depth": self.max_queue_depth,
+                "mean_write_time": mean_write_time,
+                "max_write_time": self.max_write_time,
+            }
+
+    # Write everything still queued, then stop the writer threads
+    def close(self, timeout=None):
+        for _ in self._threads:
+            self.queue.put(None)
+        for thread in self._threads:
+            thread.join(timeout)
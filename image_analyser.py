@@ -13,6 +13,8 @@ import time
 import re
 from datetime import datetime, timezone
 import shutil
+from frame_bus import read_latest_frame, minutes_bus_name
+from frame_formats import read_frame
 
 # Define the base path where the stacked image date directory is located
 image_folder = r'C:\Users\auroras\.venvMISS2\MISS2\Captured_PNG'
@@ -26,13 +28,8 @@ feed_image_folder = r'C:\Users\auroras\.venvMISS2\MISS2\Website_Spectrogram_Feed
 # Define the feed path where the keogram is updated (website)
 feed_keogram_folder = r'C:\Users\auroras\.venvMISS2\MISS2\Website_Keogram_Feed'
 
-# Function to read PNG file
-def read_png(filename):
-    # Open the PNG image
-    with Image.open(filename) as img:
-        # Convert the image to a numpy array
-        image_data = np.array(img)
-    return image_data
+# Take the latest stacked image from the shared-memory frame bus of capture_Atik.py when it is running (no disk access, no decoding)
+use_frame_bus = True
 
 # Function to resize the processed image to a square 400x400 image
 def resize_image(image):
@@ -68,7 +65,7 @@ def get_latest_image_path(image_folder):
     full_path = os.path.join(image_folder, today_path)
     if os.path.exists(full_path):
         # Define a regex pattern that matches the file naming convention
-        pattern = r'MISS2-\d{8}-\d{6}\.png'
+        pattern = r'MISS2-\d{8}-\d{6}(?:-\d{3})?\.(?:png|fits|npy)$'
         all_files = [f for f in os.listdir(full_path) if re.match(pattern, f)]
         if all_files:
             # Sort files by name, latest date and time comes last
@@ -77,6 +74,20 @@ def get_latest_image_path(image_folder):
             return os.path.join(full_path, latest_file) #return full path to latest file
     return None
 
+# Retrieve the latest stacked image (array) and its file name, from the frame bus if available, otherwise from disk
+def get_latest_image(image_folder):
+    if use_frame_bus:
+        frame = read_latest_frame(minutes_bus_name)
+        if frame is not None:
+            info, image_data = frame
+            return image_data, info["time"].strftime("MISS2-%Y%m%d-%H%M%S.png")
+
+    latest_image_file = get_latest_image_path(image_folder)
+    if latest_image_file:
+        # The feed is always a PNG figure, whatever the format of the stacked frame (.png, .fits, .npy)
+        return read_frame(latest_image_file), os.path.splitext(os.path.basename(latest_image_file))[0] + ".png"
+    return None, None
+
 # Retrieve the path to the latest keogram
 def get_latest_keogram_path(keogram_folder):
     # Today's date in UTC in YYYY/MM/DD format
@@ -98,13 +109,10 @@ try:
 
     while True:
         # Get the latest image and keogram files
-        latest_image_file = get_latest_image_path(image_folder)
+        image_data, image_name = get_latest_image(image_folder)
         latest_keogram_file = get_latest_keogram_path(keogram_folder)
 
-        if latest_image_file:
-            # Read the PNG file
-            image_data = read_png(latest_image_file)
-
+        if image_data is not None:
             # Process and resize the image
             processed_image = process_image(image_data)
             resized_image = resize_image(processed_image)
@@ -115,7 +123,7 @@ try:
             wavelengths_full = np.linspace(395, 730, num_wavelengths)
 
             # Configure plot layout: 1 main plot (spectrogram) and 2 subplots (spectral and spatial plots)
-            image_title = os.path.basename(latest_image_file)
+            image_title = image_name
             fig = plt.figure(figsize=(8, 8))  # Width, height in inches
             fig.suptitle(image_title, fontsize=14)
             gs = plt.GridSpec(3, 2, width_ratios=[5, 1], height_ratios=[1, 4, 1])   # 3 rows, 3 columns grid
@@ -159,7 +167,7 @@ try:
                     os.remove(file_path)
 
             # Save the plot directly to a file
-            processed_image_path = os.path.join(feed_image_folder, os.path.basename(latest_image_file))
+            processed_image_path = os.path.join(feed_image_folder, image_name)
             plt.savefig(processed_image_path, format='png', bbox_inches='tight')
             print ('Live spectrogram update was successful.')
 
@@ -1,6 +1,12 @@
 '''
 This program uses the RGB image-columns generated every minute using the spectrograms captured by MISS2 to update a daily keogram. Nicolas Martinez (UNIS/LTU) 2024
 
+The keogram of the day is kept in memory with a per-minute coverage mask (nothing yet, RGB-column, or missing and shown
+black) and checkpointed as raw data in a daily column store of the keogram directory (MISS2-keogram-yyyymmdd.npy and its
+coverage mask, see column_store.py), so a restart goes on from the last update. Each update only reads the columns of the
+minutes not covered yet, and the figure is rendered only when the keogram changed, by compositing the keogram into a frame
+drawn once per day (keogram_renderer.py, save_keogram draws the whole matplotlib figure instead if fast_rendering is False).
+
 '''
 
 import os
@@ -8,21 +14,27 @@ import numpy as np
 from PIL import Image
 from datetime import datetime, timezone, timedelta
 import time
-import matplotlib.pyplot as plt
+from column_store import RGBColumnStore, DailyColumnStore
+from keogram_renderer import KeogramRenderer, keogram_figure
 
-# Base directory where the RGB-columns are saved (yyyy/mm/dd)
+# Base directory where the RGB-columns are saved (yyyy/mm/dd, daily column stores or PNG files)
 rgb_dir_base = r'C:\Users\auroras\.venvMISS2\MISS2\RGB_columns'
 
 # Directory where the keogram are placed (yyyy/mm/dd)
 output_dir = r'C:\Users\auroras\.venvMISS2\MISS2\Keograms'
 
+fast_rendering = True  # Keogram composited into a pre-rendered frame, False: whole matplotlib figure at every update
+
 # Define dimensions of the keogram
 num_pixels_y = 300  # Number of pixels along the y-axis
 num_minutes = 24 * 60  # Total number of minutes in a day
 num_pixels_x = num_minutes  # Number of pixels along the x-axis
 
-# Initialize an empty keogram with white pixels
-keogram = np.full((num_pixels_y, num_pixels_x, 3), 255, dtype=np.uint8)  # White RGB empty keogram
+# Coverage of a minute of the keogram
+no_column = 0  # Nothing yet (white)
+rgb_column = 1  # RGB-column added
+missing_column = 2  # No column more than 4 minutes after the minute (black), added if it arrives later
+missing_delay = 4  # Minutes after which a minute without column is shown black
 
 # Routine check of the each image's integrity. Raise an exception if the image is corrupted
 def verify_image_integrity(file_path):
@@ -34,145 +46,148 @@ def verify_image_integrity(file_path):
         print(f"Corrupted RGB-column image detected: {file_path} - {e}")
         return False
 
-def add_rgb_columns(keogram, base_dir, last_processed_minute):
-    # Get the current date/hour (UT) in yyyy/mm/dd format
-    current_date = datetime.now(timezone.utc).strftime("%Y/%m/%d")
-
-    # Construct the directory path for the current date
-    today_RGB_dir = os.path.join(base_dir, current_date.replace('/', '\\'))
-
-    # Get the current UTC time
-    now_UT = datetime.now(timezone.utc)
-    # Convert the current time to minutes since midnight (UT)
-    current_minute_of_the_day = now_UT.hour * 60 + now_UT.minute
-
-    # Initialize a set of all minutes in the day to track found minutes
-    found_minutes = set()
-
-    # Check if the daily directory exists, if not, return the original keogram (no updates)
-    if not os.path.exists(today_RGB_dir):
-        print(f"No directory found for today's date ({today_RGB_dir}). Skipping update.")
-        return keogram
-
-    # Iteration only over new minutes since the last processed one
-    for minute in range(last_processed_minute + 1, current_minute_of_the_day):
-        # Construct the filename for the RGB column image
-        timestamp = now_UT.replace(hour=minute // 60, minute=minute % 60, second=0, microsecond=0)
-        filename = f"MISS2-{timestamp.strftime('%Y%m%d-%H%M%S')}.png"
-        file_path = os.path.join(today_RGB_dir, filename)
-
-        # Load RGB column data if file exists AND check integrity of each image
-        if os.path.exists(file_path) and verify_image_integrity(file_path):
+# Keogram of one UTC day, in memory with its coverage and checkpointed in a daily column store (minutes first on disk)
+class DailyKeogram:
+    def __init__(self, date, rgb_dir_base=rgb_dir_base, output_dir=output_dir):
+        self.date = date
+        self.rgb_dir_base = rgb_dir_base
+        self.rgb_store = RGBColumnStore(rgb_dir_base)
+        self.checkpoint = DailyColumnStore(output_dir, "keogram", np.uint8, 255, minute_axis=0)
+        self.saved = False  # Figure rendered since the keogram was loaded
+
+        # Go on from the checkpoint of the day if there is one
+        day = self.checkpoint.read_day(date)
+        if day is not None and day[0].shape == (num_minutes, num_pixels_y, 3):
+            self.keogram = np.ascontiguousarray(day[0].transpose(1, 0, 2))
+            self.coverage = np.array(day[1])
+        else:
+            self.keogram = np.full((num_pixels_y, num_pixels_x, 3), 255, dtype=np.uint8)
+            self.coverage = np.zeros(num_minutes, dtype=np.uint8)
+
+    # Add the columns of the minutes not covered yet, up to now_UT (minutes of the day after it count as complete).
+    # Returns the number of minutes changed.
+    def update(self, now_UT=None):
+        if now_UT is None:
+            now_UT = datetime.now(timezone.utc)
+        current_minute = min(num_minutes, (now_UT.date() - self.date).days * num_minutes + now_UT.hour * 60 + now_UT.minute)
+        candidates = np.flatnonzero(self.coverage[:current_minute] != rgb_column)
+        if not candidates.size:
+            return 0
+
+        # Daily column store of the column engine: presence of the candidate minutes, then their columns in one slice
+        store_day = self.rgb_store.read_day(self.date)
+        if store_day is not None and store_day[0].shape == self.keogram.shape:
+            columns, presence, _ = store_day
+            found = candidates[presence[candidates].astype(bool)]
+            self.keogram[:, found, :] = columns[:, found, :]
+        else:
+            found = self._add_png_columns(candidates)  # Minutes shown black included: their PNG column may arrive late
+
+        # Minutes without column more than missing_delay minutes before now are shown black
+        missing = candidates[(self.coverage[candidates] == no_column) & (current_minute - candidates > missing_delay)]
+        missing = np.setdiff1d(missing, found)
+        self.keogram[:, missing, :] = 0
+
+        self.coverage[found] = rgb_column
+        self.coverage[missing] = missing_column
+        metadata = {"axes": ["minute", "row", "channel"]}
+        self.checkpoint.write_minutes(self.date, [(minute, self.keogram[:, minute, :]) for minute in found], metadata, rgb_column)
+        self.checkpoint.write_minutes(self.date, [(minute, self.keogram[:, minute, :]) for minute in missing], metadata, missing_column)
+        return len(found) + len(missing)
+
+    # One PNG file per minute (days processed before the column stores): the directory is listed once and only the files
+    # of the given minutes are read. Returns the minutes added.
+    def _add_png_columns(self, minutes):
+        day_RGB_dir = os.path.join(self.rgb_dir_base, self.date.strftime("%Y"), self.date.strftime("%m"), self.date.strftime("%d"))
+        try:
+            filenames = set(os.listdir(day_RGB_dir))
+        except FileNotFoundError:
+            return np.array([], dtype=int)
+
+        found = []
+        for minute in minutes:
+            filename = f"MISS2-{self.date:%Y%m%d}-{minute // 60:02d}{minute % 60:02d}00.png"
+            file_path = os.path.join(day_RGB_dir, filename)
+            if filename not in filenames or not verify_image_integrity(file_path):
+                continue
             try:
-                rgb_data = np.array(Image.open(file_path))
-                # Ensure the RGB data has the correct shape (300, 1, 3)
-                if rgb_data.shape == (num_pixels_y, 1, 3):
-                    keogram[:, minute:minute+1, :] = rgb_data  # Add RGB column to keogram
-                    found_minutes.add(minute)
-                else:
-                    print(f"Skipped {filename} due to incorrect shape: {rgb_data.shape}")
+                with Image.open(file_path) as img:
+                    rgb_data = np.array(img)
             except Exception as e:
                 print(f"Error processing {filename}: {e}")
-
-        # Fill in missing minutes with black images for minutes more than 4 minutes before "now"
-        missing_minutes = set(range(last_processed_minute + 1, current_minute_of_the_day)) - found_minutes
-        for minute in missing_minutes:
-            # At the condition that the data-minute is more than 4 minutes away from now to prevent false blanks
-            if current_minute_of_the_day - minute > 4:
-                keogram[:, minute:minute+1, :] = np.zeros((num_pixels_y, 1, 3), dtype=np.uint8) 
-
-    return keogram
-
-# Ensure that any pre-existing keogram for today will be loaded and updated
-def load_existing_keogram(output_dir):
-    # Get the current UTC time
-    current_utc_time = datetime.now(timezone.utc)
-    
-    # If the current time is before 00:05, load the keogram from the previous day
-    if current_utc_time.hour == 0 and current_utc_time.minute < 5:
-        previous_date = (current_utc_time - timedelta(days=1)).strftime('%Y/%m/%d')
-        keogram_path = os.path.join(output_dir, previous_date.replace('/', '\\'), 'keogram-MISS2.png')
-        if os.path.exists(keogram_path):
-            # Load the existing keogram if it exists
-            with Image.open(keogram_path) as img:
-                keogram = np.array(img)
-                last_processed_minute = 1439  # Last minute of the day
-            return keogram, last_processed_minute
-        else:
-            # Otherwise, initialize a new keogram
-            return np.full((300, 1440, 3), 255, dtype=np.uint8), 0  # White RGB empty keogram and last processed minute as 0
-    
-    # Otherwise, load the keogram for the current day
-    else:
-        # Get the current UTC date
-        current_date = current_utc_time.strftime('%Y/%m/%d')
-        keogram_path = os.path.join(output_dir, current_date.replace('/', '\\'), 'keogram-MISS2.png')
-        if os.path.exists(keogram_path):
-            # Load the existing keogram if it exists
-            with Image.open(keogram_path) as img:
-                keogram = np.array(img)
-                last_processed_minute = 1439  # Last minute of the day
-            return keogram, last_processed_minute
-        else:
-            # Otherwise, initialize a new keogram
-            return np.full((300, 1440, 3), 255, dtype=np.uint8), 0  # White RGB empty keogram and last processed minute as 0
-
-def save_keogram(keogram, output_dir):
-    # Get the current UTC time
-    current_utc_time = datetime.now(timezone.utc)
+                continue
+            if rgb_data.shape == (num_pixels_y, 1, 3):
+                self.keogram[:, minute:minute+1, :] = rgb_data
+                found.append(minute)
+            else:
+                print(f"Skipped {filename} due to incorrect shape: {rgb_data.shape}")
+        return np.array(found, dtype=int)
+
+    def close(self):
+        self.checkpoint.close()
+
+# Keograms of the UTC days that may still receive columns: the current day, and the previous one until rollover_minutes
+# after midnight (its last columns are made after 00:00)
+class KeogramMaker:
+    # renderer: KeogramRenderer, None to draw the whole matplotlib figure (save_keogram)
+    def __init__(self, rgb_dir_base=rgb_dir_base, output_dir=output_dir, rollover_minutes=5, renderer=None):
+        self.rgb_dir_base = rgb_dir_base
+        self.output_dir = output_dir
+        self.rollover_minutes = rollover_minutes
+        self.renderer = renderer
+        self.days = {}  # date -> DailyKeogram
+
+    # Update the keograms with the new columns and save the figures of those that changed. Returns the updated days.
+    def update(self, now_UT=None):
+        if now_UT is None:
+            now_UT = datetime.now(timezone.utc)
+        dates = [now_UT.date()]
+        if now_UT.hour == 0 and now_UT.minute < self.rollover_minutes:
+            dates.insert(0, now_UT.date() - timedelta(days=1))
+        for date in [date for date in self.days if date not in dates]:
+            self.days.pop(date).close()
+
+        updated = []
+        for date in dates:
+            if date not in self.days:
+                self.days[date] = DailyKeogram(date, self.rgb_dir_base, self.output_dir)
+            daily_keogram = self.days[date]
+            if daily_keogram.update(now_UT) or not daily_keogram.saved:
+                if self.renderer is not None:
+                    self.renderer.save(daily_keogram.keogram, self.output_dir, date)
+                else:
+                    save_keogram(daily_keogram.keogram, self.output_dir, date)
+                daily_keogram.saved = True
+                updated.append(date)
+        return updated
+
+# Whole matplotlib figure of the keogram (fallback of KeogramRenderer). date: day of the keogram (default: current UTC day)
+def save_keogram(keogram, output_dir, date=None):
+    start = time.perf_counter()
+    current_utc_time = datetime.now(timezone.utc) if date is None else date
     # Create the directory path for the current date
     current_date_dir = os.path.join(output_dir, current_utc_time.strftime('%Y/%m/%d'))
     os.makedirs(current_date_dir, exist_ok=True)
 
     # Plot and save the keogram
-    fig, ax = plt.subplots(figsize=(20, 6))
-    ax.imshow(keogram, aspect='auto', extent=[0, 24*60, 90, -90])
-    ax.set_title(f"Meridian Imaging Svalbard Spectrograph II (KHO/UNIS) {current_utc_time.strftime('%Y-%m-%d')}", fontsize=20)
-
-    # Set x-axis for hours
-    x_ticks = np.arange(0, 24*60, 60)  # Positions for each hour
-    x_labels = [f"{hour}:00" for hour in range(24)]  # Labels for each hour
-    ax.set_xticks(x_ticks)
-    ax.set_xticklabels(x_labels)
-    ax.set_xlabel("Time (UT)")
-
-    #Set y-axis for south, zenith and north
-    y_ticks = np.linspace(-90, 90, num=7)
-    ax.set_yticks(y_ticks)
-    ax.set_yticklabels(['90° S', '60° S', '30° S', 'Zenith', '30° N', '60° N', '90° N'])
-    ax.set_ylim(-90, 90)
-    ax.set_ylabel("Zenith angle (degrees)")
-
-    # Save the updated keogram
+    fig, ax = keogram_figure(keogram, current_utc_time)
     keogram_filename = os.path.join(current_date_dir, f'keogram-MISS2-{current_utc_time.strftime("%Y%m%d")}.png')
-    plt.savefig(keogram_filename)
-    plt.close(fig)
-    print(f"Keogram saved: {keogram_filename}")
+    fig.savefig(keogram_filename)
+    print(f"Keogram saved: {keogram_filename} (rendered in {(time.perf_counter() - start) * 1000:.0f} ms)")
 
-# Update the keogram every 5 minutes
+# Update the keogram every minute
 def main():
+    keogram_maker = KeogramMaker(rgb_dir_base, output_dir, renderer=KeogramRenderer() if fast_rendering else None)
     while True:  # Start of the infinite loop
         try:
-            # Get the current UTC time
-            current_utc_time = datetime.now(timezone.utc) 
-
-            # Check if it's time for an update (every 5 minutes)
-            if current_utc_time.minute % 1 == 0:
-                # Continue updating the existing keogram
-                keogram, last_processed_minute = load_existing_keogram(output_dir)  # Unpack the returned values correctly
-
-                # Update the keogram
-                keogram = add_rgb_columns(keogram, rgb_dir_base, last_processed_minute)
-                save_keogram(keogram, output_dir)
-                print("Update completed.")
-            else:
-                print("Waiting for the next update...")
-
-            # Wait for 1 minute before the next check
-            time.sleep(60)
-
+            # Add the new columns to the keogram (kept in memory and checkpointed) and save it if it changed
+            keogram_maker.update()
+            print("Update completed.")
         except Exception as e:
             print(f"An error occurred: {e}")
 
+        # Wait for 1 minute before the next check
+        time.sleep(60)
+
 if __name__ == "__main__":
     main()
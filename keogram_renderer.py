@@ -0,0 +1,122 @@
+'''
+Rendering of the daily keogram figure of keogram_maker.py. The figure (title, axes, ticks, labels) only changes with the
+date, so it is drawn once per day with matplotlib and kept as an RGB array with the pixel box of the keogram in it; each
+update scales the keogram into that box with PIL and encodes the PNG, instead of building and drawing a new 20x6 inch
+figure every minute. The axes lines drawn over the keogram are put back on top after the keogram is pasted.
+
+The PNG is encoded here rather than by PIL: PIL tries every PNG filter on every row, which on a noisy 2000x600 keogram
+costs ~100 ms of the update. One "Up" filter for all rows (the keogram rows are repeated by the scaling, the frame is
+mostly uniform) computed with numpy, and zlib level 1 with run-length matching, encode it in ~25 ms into a file slightly
+smaller than PIL's. A steady-state update (composite, encode, write) of a keogram of pure noise, the worst case, takes
+~65 ms instead of ~150-200 ms.
+
+The matplotlib figure itself (keogram_figure) is still used for the static frame and by save_keogram of keogram_maker.py,
+the fallback that draws the whole figure.
+
+'''
+
+import os
+import time
+import zlib
+import struct
+import numpy as np
+from PIL import Image
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+
+# Matplotlib figure of a keogram (300, 1440, 3) of a date (datetime.date or datetime)
+def keogram_figure(keogram, date, figsize=(20, 6), dpi=100):
+    fig = Figure(figsize=figsize, dpi=dpi)
+    FigureCanvasAgg(fig)
+    ax = fig.subplots()
+    ax.imshow(keogram, aspect='auto', extent=[0, 24*60, 90, -90])
+    ax.set_title(f"Meridian Imaging Svalbard Spectrograph II (KHO/UNIS) {date.strftime('%Y-%m-%d')}", fontsize=20)
+
+    # Set x-axis for hours
+    x_ticks = np.arange(0, 24*60, 60)  # Positions for each hour
+    x_labels = [f"{hour}:00" for hour in range(24)]  # Labels for each hour
+    ax.set_xticks(x_ticks)
+    ax.set_xticklabels(x_labels)
+    ax.set_xlabel("Time (UT)")
+
+    #Set y-axis for south, zenith and north
+    y_ticks = np.linspace(-90, 90, num=7)
+    ax.set_yticks(y_ticks)
+    ax.set_yticklabels(['90° S', '60° S', '30° S', 'Zenith', '30° N', '60° N', '90° N'])
+    ax.set_ylim(-90, 90)
+    ax.set_ylabel("Zenith angle (degrees)")
+    return fig, ax
+
+
+# PNG file of an RGB array (height, width, 3) uint8: every row "Up" filtered, compressed with zlib at compress_level with
+# run-length matching (Z_RLE)
+def encode_png(rgb, compress_level=1):
+    height, width, _ = rgb.shape
+    rows = rgb.reshape(height, width * 3)
+    filtered = np.empty((height, width * 3 + 1), dtype=np.uint8)
+    filtered[:, 0] = 2  # Filter type Up: difference with the row above (the first row is compared with zeros)
+    filtered[0, 1:] = rows[0]
+    np.subtract(rows[1:], rows[:-1], out=filtered[1:, 1:])
+    compressor = zlib.compressobj(compress_level, zlib.DEFLATED, 15, 9, zlib.Z_RLE)
+    image_data = compressor.compress(filtered.tobytes()) + compressor.flush()
+
+    def chunk(chunk_type, data):
+        return struct.pack(">I", len(data)) + chunk_type + data + struct.pack(">I", zlib.crc32(chunk_type + data))
+    header = struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)  # 8 bits per channel, RGB, no interlacing
+    return b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", header) + chunk(b"IDAT", image_data) + chunk(b"IEND", b"")
+
+
+class KeogramRenderer:
+    # figsize/dpi: size of the figure (the one of save_keogram by default), compress_level: zlib level of the PNG
+    # (1: fast, 6: default of PIL and matplotlib)
+    def __init__(self, figsize=(20, 6), dpi=100, compress_level=1):
+        self.figsize = figsize
+        self.dpi = dpi
+        self.compress_level = compress_level
+        self._frames = {}  # date -> (RGB frame, (top, bottom, left, right) of the keogram, axes lines over the keogram)
+
+    # Static frame of a date, drawn with matplotlib the first time
+    def static_frame(self, date):
+        if date in self._frames:
+            return self._frames[date]
+
+        fig, ax = keogram_figure(np.full((1, 1, 3), 255, dtype=np.uint8), date, self.figsize, self.dpi)
+        fig.canvas.draw()
+        frame = np.array(fig.canvas.buffer_rgba())[..., :3]
+
+        # Pixel box of the axes (matplotlib counts from the bottom), the keogram fills it (aspect auto, extent = limits)
+        box = ax.get_window_extent()
+        top, bottom = frame.shape[0] - int(round(box.y1)), frame.shape[0] - int(round(box.y0))
+        left, right = int(round(box.x0)), int(round(box.x1))
+        overlay = np.any(frame[top:bottom, left:right] != 255, axis=2)
+
+        # Only the frames of the days being updated are kept (two around midnight)
+        if len(self._frames) >= 2:
+            del self._frames[min(self._frames)]
+        self._frames[date] = (frame, (top, bottom, left, right), overlay)
+        return self._frames[date]
+
+    # RGB array of the figure of a keogram
+    def render(self, keogram, date):
+        frame, (top, bottom, left, right), overlay = self.static_frame(date)
+        # The y-axis goes from south (-90, bottom) to north, the first row of the keogram is at the bottom
+        scaled = np.asarray(Image.fromarray(keogram[::-1]).resize((right - left, bottom - top), Image.NEAREST))
+        image = frame.copy()
+        np.copyto(image[top:bottom, left:right], scaled, where=~overlay[..., None])
+        return image
+
+    # Render and save the keogram of a date in its date directory (replaced atomically, never read half written).
+    # Returns the path of the PNG file and the render time (s).
+    def save(self, keogram, output_dir, date):
+        start = time.perf_counter()
+        date_dir = os.path.join(output_dir, date.strftime('%Y/%m/%d'))
+        os.makedirs(date_dir, exist_ok=True)
+        keogram_filename = os.path.join(date_dir, f'keogram-MISS2-{date.strftime("%Y%m%d")}.png')
+        temporary_filename = keogram_filename + ".tmp"
+        with open(temporary_filename, "wb") as f:
+            f.write(encode_png(self.render(keogram, date), self.compress_level))
+        os.replace(temporary_filename, keogram_filename)
+        render_time = time.perf_counter() - start
+        print(f"Keogram saved: {keogram_filename} (rendered in {render_time * 1000:.0f} ms)")
+        return keogram_filename, render_time
@@ -0,0 +1,252 @@
+'''
+Zoomable pyramid of keogram tiles over long time ranges (months of RGB-columns), served as static files to a keogram viewer.
+Four levels: one column per minute, per 10 minutes, per hour and per day. A column of a coarse level is the mean of the
+RGB-columns of its minutes (those with data) and is computed from the daily column store (column_store.RGBColumnStore, or
+the PNG columns of days made before the stores), so no level is derived from a rounded one.
+
+Updates are incremental: the minutes of each day already in the tiles are recorded, and only the columns of the minutes
+that are new (or of a day whose columns were remade) are computed, then written into the tiles containing them. A live
+update is a handful of columns in one tile per level; a season is one pass over its days, each tile written once.
+
+Layout of the tile directory:
+- tiles.json: epoch, tile width, column height and levels, for the viewer
+- <level>/<tile>.png: RGBA tile of tile_width columns; column x of tile t starts at epoch + (t * tile_width + x) * minutes
+  per column, transparent where there is no data
+- tile-state.json: minutes of each day already in the tiles
+
+Example: python keogram_tiles.py --start 2024/01/01 --end 2024/03/31 (live update every minute without --start)
+
+'''
+
+import os
+import json
+import time
+import argparse
+import datetime
+import numpy as np
+from PIL import Image
+
+from column_store import RGBColumnStore, minutes_per_day
+
+# Base directory where the RGB-columns are saved (yyyy/mm/dd, daily column stores or PNG files)
+rgb_dir_base = r'C:\Users\auroras\.venvMISS2\MISS2\RGB_columns'
+
+# Directory of the tile pyramid
+tiles_dir = r'C:\Users\auroras\.venvMISS2\MISS2\Keogram_tiles'
+
+levels = (("minute", 1), ("10min", 10), ("hour", 60), ("day", 1440))  # Name and minutes per column of each level
+tile_width = 512  # Columns per tile
+epoch = datetime.date(1970, 1, 1)  # Column 0 of tile 0 of every level starts at 00:00 UT of this day
+num_pixels_y = 300  # Height of the RGB-columns
+
+
+# RGB-columns of a day: ((300, 1440, 3) columns, (1440,) presence), None if the day has none. From the daily column store,
+# or from the PNG columns (directory listed once, only the existing files read)
+def day_columns(rgb_dir_base, date):
+    store_day = RGBColumnStore(rgb_dir_base).read_day(date)
+    if store_day is not None:
+        return store_day[0], store_day[1].astype(bool)
+
+    day_dir = os.path.join(rgb_dir_base, date.strftime("%Y"), date.strftime("%m"), date.strftime("%d"))
+    try:
+        filenames = set(os.listdir(day_dir))
+    except FileNotFoundError:
+        return None
+    columns = np.full((num_pixels_y, minutes_per_day, 3), 255, dtype=np.uint8)
+    presence = np.zeros(minutes_per_day, dtype=bool)
+    for minute in range(minutes_per_day):
+        filename = f"MISS2-{date:%Y%m%d}-{minute // 60:02d}{minute % 60:02d}00.png"
+        if filename not in filenames:
+            continue
+        try:
+            with Image.open(os.path.join(day_dir, filename)) as img:
+                rgb_data = np.array(img)
+        except Exception as e:
+            print(f"Error processing {filename}: {e}")
+            continue
+        if rgb_data.shape == (num_pixels_y, 1, 3):
+            columns[:, minute] = rgb_data[:, 0]
+            presence[minute] = True
+    return (columns, presence) if presence.any() else None
+
+# Mean RGBA columns of a day at a level: (300, 1440 / minutes_per_column, 4), transparent where there is no data
+def level_columns(columns, presence, minutes_per_column):
+    count = minutes_per_day // minutes_per_column
+    weights = presence.reshape(1, count, minutes_per_column, 1)
+    sums = (columns.reshape(num_pixels_y, count, minutes_per_column, 3) * weights).sum(axis=2, dtype=np.uint32)
+    present = presence.reshape(count, minutes_per_column).sum(axis=1)
+    rgba = np.zeros((num_pixels_y, count, 4), dtype=np.uint8)
+    rgba[..., :3] = np.rint(sums / np.maximum(present, 1)[None, :, None])
+    rgba[:, present > 0, 3] = 255
+    return rgba
+
+
+class KeogramTiles:
+    def __init__(self, rgb_dir_base=rgb_dir_base, tiles_dir=tiles_dir, tile_width=tile_width):
+        self.rgb_dir_base = rgb_dir_base
+        self.tiles_dir = tiles_dir
+        self.tile_width = tile_width
+        self.pending = {}  # (level, tile) -> {column in the tile: RGBA column} not written yet
+        self.pending_state = {}  # "yyyymmdd" -> state of the day once its pending columns are written
+        try:
+            with open(self.state_path()) as f:
+                self.state = json.load(f)  # "yyyymmdd" -> {"minutes": packed presence (hex), "stamp": stamp of the columns}
+        except (OSError, ValueError):
+            self.state = {}
+
+    def state_path(self):
+        return os.path.join(self.tiles_dir, "tile-state.json")
+
+    def tile_path(self, level, tile):
+        return os.path.join(self.tiles_dir, level, f"{tile}.png")
+
+    # Description of the pyramid for the viewer
+    def write_description(self):
+        description = {"epoch": epoch.isoformat() + "T00:00Z", "tile_width": self.tile_width, "height": num_pixels_y, "path": "{level}/{tile}.png",
+                       "levels": [{"name": name, "minutes_per_column": minutes_per_column} for name, minutes_per_column in levels]}
+        os.makedirs(self.tiles_dir, exist_ok=True)
+        with open(os.path.join(self.tiles_dir, "tiles.json"), "w") as f:
+            json.dump(description, f, indent=1)
+
+    # Minutes of a day with a RGB-column, and a stamp of the columns (changes when the day is remade), without decoding
+    # any column. None if the day has no columns.
+    def day_presence(self, date):
+        store = RGBColumnStore(self.rgb_dir_base)
+        if store.exists(date):
+            presence = np.load(store.path(date, "-presence.npy")).astype(bool)
+            return presence, os.stat(store.path(date)).st_mtime_ns
+        day_dir = os.path.join(self.rgb_dir_base, date.strftime("%Y"), date.strftime("%m"), date.strftime("%d"))
+        try:
+            filenames = set(os.listdir(day_dir))
+        except FileNotFoundError:
+            return None
+        presence = np.array([f"MISS2-{date:%Y%m%d}-{minute // 60:02d}{minute % 60:02d}00.png" in filenames for minute in range(minutes_per_day)])
+        return presence, os.stat(day_dir).st_mtime_ns
+
+    # Compute the columns of the new minutes of a day at every level (written by flush). Returns the number of new minutes.
+    def update_day(self, date):
+        day_key = date.strftime("%Y%m%d")
+        day_presence = self.day_presence(date)
+        if day_presence is None:
+            return 0
+        presence, stamp = day_presence
+
+        recorded = self.pending_state.get(day_key) or self.state.get(day_key)
+        recorded_presence = None
+        remade = False
+        if recorded is None:
+            if not presence.any():
+                return 0
+        else:
+            recorded_presence = np.unpackbits(np.frombuffer(bytes.fromhex(recorded["minutes"]), dtype=np.uint8))[:minutes_per_day].astype(bool)
+            if np.array_equal(presence, recorded_presence):
+                if recorded["stamp"] == stamp:
+                    return 0
+                remade = True  # Same minutes, remade columns
+
+        # The changed minutes are taken from the columns read, not from the presence above: a minute written in between is
+        # tiled now, never recorded as tiled without its column
+        day = day_columns(self.rgb_dir_base, date)
+        columns, presence = day if day is not None else (np.full((num_pixels_y, minutes_per_day, 3), 255, dtype=np.uint8), np.zeros(minutes_per_day, dtype=bool))
+        if recorded_presence is None:
+            changed = presence
+        elif remade:
+            changed = presence | recorded_presence
+        else:
+            changed = presence != recorded_presence
+        if not changed.any():
+            return 0
+        changed_minutes = np.flatnonzero(changed)
+        first_minute = (date - epoch).days * minutes_per_day
+        for level, minutes_per_column in levels:
+            rgba = level_columns(columns, presence, minutes_per_column)
+            for column in np.unique(changed_minutes // minutes_per_column):
+                tile, x = divmod(first_minute // minutes_per_column + int(column), self.tile_width)
+                self.pending.setdefault((level, tile), {})[x] = rgba[:, column]
+
+        self.pending_state[day_key] = {"minutes": np.packbits(presence).tobytes().hex(), "stamp": stamp}
+        return len(changed_minutes)
+
+    # Write the pending columns into their tiles, only the tiles ending before before_minute (minutes since the epoch)
+    # if given, and record the days done once everything is written
+    def flush(self, before_minute=None):
+        minutes_per_column = dict(levels)
+        for (level, tile), tile_columns in list(self.pending.items()):
+            if before_minute is not None and (tile + 1) * self.tile_width * minutes_per_column[level] > before_minute:
+                continue
+            tile_path = self.tile_path(level, tile)
+            try:
+                with Image.open(tile_path) as img:
+                    image = np.array(img.convert("RGBA"))
+            except (OSError, ValueError):
+                image = np.zeros((num_pixels_y, self.tile_width, 4), dtype=np.uint8)
+            for x, rgba in tile_columns.items():
+                image[:, x] = rgba
+
+            os.makedirs(os.path.dirname(tile_path), exist_ok=True)
+            temporary_path = tile_path + ".tmp"
+            Image.fromarray(image, mode="RGBA").save(temporary_path, format="PNG", compress_level=1)
+            os.replace(temporary_path, tile_path)
+            del self.pending[(level, tile)]
+
+        if not self.pending and self.pending_state:
+            self.state.update(self.pending_state)
+            self.pending_state = {}
+            os.makedirs(self.tiles_dir, exist_ok=True)
+            temporary_path = self.state_path() + ".tmp"
+            with open(temporary_path, "w") as f:
+                json.dump(self.state, f, separators=(",", ":"), sort_keys=True)
+            os.replace(temporary_path, self.state_path())
+
+    # Update the tiles with the new minutes of the given days (in order, the tiles are written as soon as no later day
+    # can touch them). Returns the number of new minutes.
+    def update(self, dates, rebuild=False):
+        if not os.path.exists(os.path.join(self.tiles_dir, "tiles.json")):
+            self.write_description()
+        new_minutes = 0
+        for date in sorted(dates):
+            if rebuild:
+                self.state.pop(date.strftime("%Y%m%d"), None)
+            new_minutes += self.update_day(date)
+            self.flush(before_minute=((date - epoch).days + 1) * minutes_per_day)
+        self.flush()
+        return new_minutes
+
+    # Live mode: the current UTC day (and the previous one just after midnight) every minute
+    def run_live(self, interval=60, rollover_minutes=5):
+        while True:
+            now_UT = datetime.datetime.now(datetime.timezone.utc)
+            dates = [now_UT.date()]
+            if now_UT.hour == 0 and now_UT.minute < rollover_minutes:
+                dates.insert(0, now_UT.date() - datetime.timedelta(days=1))
+            try:
+                self.update(dates)
+            except Exception as e:
+                print(f"An error occurred: {e}")
+            time.sleep(interval)
+
+
+def parse_date(date_string):
+    return datetime.datetime.strptime(date_string, "%Y/%m/%d").date()
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the zoomable keogram tile pyramid of MISS2.")
+    parser.add_argument("--start", type=parse_date, help="First day (yyyy/mm/dd), live mode if omitted")
+    parser.add_argument("--end", type=parse_date, help="Last day (yyyy/mm/dd), defaults to --start")
+    parser.add_argument("--rgb-dir", default=rgb_dir_base, help="Directory of the RGB-columns")
+    parser.add_argument("--tiles-dir", default=tiles_dir, help="Directory of the tile pyramid")
+    parser.add_argument("--rebuild", action="store_true", help="Recompute the days even if their columns did not change")
+    args = parser.parse_args()
+
+    tiles = KeogramTiles(args.rgb_dir, args.tiles_dir)
+    if args.start is None:
+        tiles.run_live()
+    else:
+        end = args.end or args.start
+        start = time.perf_counter()
+        dates = [args.start + datetime.timedelta(days=i) for i in range((end - args.start).days + 1)]
+        new_minutes = tiles.update(dates, args.rebuild)
+        print(f"Tiled {new_minutes} new minutes over {len(dates)} days in {time.perf_counter() - start:.1f} s")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+'''
+Minute-wise stacking of the MISS2 frames directly in the capture process. Each frame is added to a running float
+accumulator of its UTC minute, and the averaged 16-bit frame is handed over as soon as the minute is over, without
+re-reading the raw frames from disk (same result as average_PNG_maker.py).
+
+'''
+
+import datetime
+import numpy as np
+
+
+class MinuteStacker:
+    # on_minute_closed(minute_time, averaged_uint16_array, frame_count) is called every time a minute is complete
+    def __init__(self, on_minute_closed):
+        self.on_minute_closed = on_minute_closed
+        self.current_minute = None
+        self.sum_array = None
+        self.count = 0
+
+    # Add a frame captured at capture_time (UTC datetime) to the stack of its minute
+    def add(self, frame, capture_time):
+        minute = capture_time.replace(second=0, microsecond=0)
+        if self.current_minute is not None and minute != self.current_minute:
+            self.close_minute()
+        if self.sum_array is not None and self.sum_array.shape != frame.shape:
+            self.close_minute()  # Frame size changed (binning), frames of different sizes cannot be averaged together
+
+        if self.sum_array is None or self.sum_array.shape != frame.shape:
+            self.sum_array = np.zeros(frame.shape, dtype='float64')
+        self.current_minute = minute
+        np.add(self.sum_array, frame, out=self.sum_array)  # Accumulate in place, no new array per frame
+        self.count += 1
+
+    # Close the current minute if the given time (UTC datetime) is already past it
+    def close_minute_before(self, current_time):
+        if self.current_minute is not None and current_time - self.current_minute >= datetime.timedelta(minutes=1):
+            self.close_minute()
+
+    # Average the frames of the current minute and hand the result over
+    def close_minute(self):
+        if self.count == 0:
+            return
+        minute, count = self.current_minute, self.count
+        averaged_image = (self.sum_array / count).astype(np.uint16)
+
+        # Reset the accumulator for the next minute before calling back (the callback may be slow)
+        self.sum_array.fill(0)
+        self.count = 0
+        self.current_minute = None
+
+        self.on_minute_closed(minute, averaged_image, count)
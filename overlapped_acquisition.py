@@ -0,0 +1,85 @@
+'''
+Overlapped (fast/continuous) acquisition with the Atik SDK. The camera keeps exposing frame N+1 while frame N is read out,
+and every frame read out is delivered through the SDK fast callback, so the frame rate is limited by max(exposure, readout)
+instead of exposure + readout + saving. Used by capture_Atik.py for high-cadence bursts during active aurora.
+
+'''
+
+import queue
+import time
+import threading
+import datetime
+
+
+class FastModeAcquisition:
+    # camera: connected AtikSDK.AtikSDKCamera (or simulated_AtikSDK.AtikSDKCamera)
+    # queue_size: number of read-out frames allowed to wait for the capture loop before new frames are dropped
+    def __init__(self, camera, exposure_duration, queue_size=8):
+        self.camera = camera
+        self.exposure_duration = exposure_duration
+        self.frame_queue = queue.Queue(maxsize=queue_size)
+        self.running = False
+
+        self.frames_received = 0
+        self.frames_dropped = 0
+        self.first_frame_time = None
+        self.last_frame_time = None
+        self._lock = threading.Lock()
+
+    # Called from the SDK thread every time a frame has been read out
+    def _on_frame(self, image_array):
+        frame_time = datetime.datetime.now(datetime.timezone.utc)
+        received = time.monotonic()
+        with self._lock:
+            self.frames_received += 1
+            if self.first_frame_time is None:
+                self.first_frame_time = received
+            self.last_frame_time = received
+        try:
+            self.frame_queue.put_nowait((image_array, frame_time))
+        except queue.Full:
+            with self._lock:
+                self.frames_dropped += 1
+
+    def start(self):
+        if not self.camera.continuous_mode_supported():
+            raise RuntimeError("The camera does not support continuous (overlapped) exposures")
+        self.camera.set_fast_callback(self._on_frame)
+        self.camera.set_continuous_mode(True)
+        self.running = True
+        self.camera.start_fast_exposure(int(self.exposure_duration * 1000))  # Exposure in ms
+        print("Fast (overlapped) acquisition started.")
+
+    def stop(self):
+        if not self.running:
+            return
+        self.running = False
+        try:
+            self.camera.stop_exposure()
+            self.camera.set_continuous_mode(False)
+            self.camera.set_fast_callback(None)
+        except Exception as e:
+            print(f"Could not stop fast acquisition cleanly: {e}")
+
+    # Yield (image_array, UTC time of read-out) for every frame until stop() is called
+    def frames(self, timeout=1.0):
+        while self.running:
+            try:
+                yield self.frame_queue.get(timeout=timeout)
+            except queue.Empty:
+                continue
+
+    def stats(self):
+        with self._lock:
+            frame_rate = 0.0
+            if self.frames_received > 1:
+                frame_rate = (self.frames_received - 1) / (self.last_frame_time - self.first_frame_time)
+            return {
+                "received": self.frames_received,
+                "dropped": self.frames_dropped,
+                "frame_rate": frame_rate,
+            }
+
+    def summary(self):
+        s = self.stats()
+        return f"Fast acquisition: {s['received']} frames ({s['frame_rate']:.2f} frames/s), {s['dropped']} dropped"
@@ -1,9 +1,26 @@
+'''
+Makes the keogram of past dates out of the RGB-columns: one date asked interactively, or a range of dates in batch:
+
+    python past-keogram-maker.py --start 2024/01/01 --end 2024/03/31
+
+In batch mode each day directory is listed once, only the column files that exist are decoded, the days are spread over a
+process pool, and a day is skipped if its columns have not changed since its keogram was made (the stamp of its inputs is
+saved next to the keogram, keogram-MISS2-yyyymmdd.json). --force remakes them all.
+
+'''
+
 import os
+import json
+import hashlib
+import argparse
+import datetime
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import numpy as np
 from PIL import Image
 import matplotlib.pyplot as plt
+from column_store import RGBColumnStore
 
-# Base directory where the RGB image-columns are saved (yyyy/mm/dd)
+# Base directory where the RGB image-columns are saved (yyyy/mm/dd, daily column stores or PNG files)
 rgb_dir_base = r'C:\Users\auroras\.venvMISS2\MISS2\RGB_columns'
 
 # Directory where the keograms are placed (yyyy/mm/dd)
@@ -14,46 +31,73 @@ num_pixels_y = 300  # Number of pixels along the y-axis
 num_minutes = 24 * 60  # Total number of minutes in a day
 num_pixels_x = num_minutes  # Number of pixels along the x-axis
 
-def verify_image_integrity(file_path):
+# Files of the RGB-columns of a date (yyyy/mm/dd) and a stamp of them (changes when a column is added or remade), from
+# one listing of the day directory: (stamp, file names or None for a daily column store), None if the day has no columns
+def scan_day(base_dir, date):
+    store = RGBColumnStore(base_dir)
+    day = datetime.datetime.strptime(date, "%Y/%m/%d").date()
+    if store.exists(day):
+        stamp = [(os.path.basename(path), os.stat(path).st_size, os.stat(path).st_mtime_ns) for path in (store.path(day), store.path(day, "-presence.npy"))]
+        return hashlib.sha1(repr(stamp).encode()).hexdigest(), None
+
     try:
-        with Image.open(file_path) as img:
-            img.verify()  # Verify the integrity of the image
-        return True
-    except Exception as e:
-        print(f"Corrupted RGB-column image detected: {file_path} - {e}")
-        return False
-
-def add_rgb_columns(keogram, base_dir, date):
-    # Construct the directory path for the given date
-    rgb_dir = os.path.join(base_dir, date.replace('/', '\\'))
-
-    # Iterate over all minutes of the day
+        with os.scandir(os.path.join(base_dir, *date.split('/'))) as entries:
+            files = sorted((entry.name, entry.stat().st_size, entry.stat().st_mtime_ns) for entry in entries if entry.name.startswith("MISS2-") and entry.name.endswith(".png"))
+    except FileNotFoundError:
+        return None
+    if not files:
+        return None
+    return hashlib.sha1(repr(files).encode()).hexdigest(), {name for name, _, _ in files}
+
+# filenames: RGB-column files of the day directory if already listed (see scan_day)
+def add_rgb_columns(keogram, base_dir, date, filenames=None):
+    # Daily column store of the column engine: the whole day in one slice of the memory map
+    store_day = RGBColumnStore(base_dir).read_day(datetime.datetime.strptime(date, "%Y/%m/%d").date())
+    if store_day is not None and store_day[0].shape == keogram.shape:
+        columns, presence, _ = store_day
+        present = presence.astype(bool)
+        keogram[:, present, :] = columns[:, present, :]
+        keogram[:, ~present, :] = 0  # Replace missing RGB data with black pixels
+        print(f"No RGB data found for {np.count_nonzero(~present)} minutes of {date}")
+        return keogram
+
+    # Construct the directory path for the given date, listed once
+    rgb_dir = os.path.join(base_dir, *date.split('/'))
+    if filenames is None:
+        try:
+            filenames = set(os.listdir(rgb_dir))
+        except FileNotFoundError:
+            filenames = set()
+
+    # Iterate over all minutes of the day, only the files that exist are decoded
+    missing_minutes = 0
     for minute in range(num_minutes):
         # Construct the filename for the RGB column image
         filename = f"MISS2-{date.replace('/', '')}-{minute//60:02d}{minute%60:02d}00.png"
-        file_path = os.path.join(rgb_dir, filename)
-
-        # Check if RGB image exists for the target date and is valid
-        if os.path.exists(file_path) and verify_image_integrity(file_path):
+        rgb_data = None
+        if filename in filenames:
             try:
-                rgb_data = np.array(Image.open(file_path))
-                # Ensure the RGB data has the correct shape (300, 1, 3)
-                if rgb_data.shape == (num_pixels_y, 1, 3):
-                    keogram[:, minute:minute+1, :] = rgb_data  # Add RGB column to keogram
-                else:
-                    print(f"Skipped {filename} due to incorrect shape: {rgb_data.shape}")
+                with Image.open(os.path.join(rgb_dir, filename)) as img:
+                    rgb_data = np.array(img)
             except Exception as e:
-                print(f"Error processing {filename}: {e}")
+                print(f"Corrupted RGB-column image detected: {filename} - {e}")
+
+        # Ensure the RGB data has the correct shape (300, 1, 3)
+        if rgb_data is not None and rgb_data.shape == (num_pixels_y, 1, 3):
+            keogram[:, minute:minute+1, :] = rgb_data  # Add RGB column to keogram
         else:
-            print(f"No RGB data found for minute {minute} of {date}")
+            if rgb_data is not None:
+                print(f"Skipped {filename} due to incorrect shape: {rgb_data.shape}")
             # Replace missing RGB data with black pixels
             keogram[:, minute:minute+1, :] = 0
+            missing_minutes += 1
 
+    print(f"No RGB data found for {missing_minutes} minutes of {date}")
     return keogram
 
 def save_keogram(keogram, output_dir, date):
     # Create the directory path for the given date
-    date_dir = os.path.join(output_dir, date.replace('/', '\\'))
+    date_dir = os.path.join(output_dir, *date.split('/'))
     os.makedirs(date_dir, exist_ok=True)
 
     # Plot and save the keogram
@@ -81,7 +125,63 @@ def save_keogram(keogram, output_dir, date):
     plt.close(fig)
     print(f"Keogram saved: {keogram_filename}")
 
+def stamp_path(output_dir, date):
+    return os.path.join(output_dir, *date.split('/'), f'keogram-MISS2-{date.replace("/", "")}.json')
+
+# Make the keogram of a date (yyyy/mm/dd) unless its columns have not changed since it was made (or force).
+# Returns "made", "unchanged" or "no data".
+def make_keogram(date, base_dir=rgb_dir_base, output_dir=output_dir, force=False):
+    scan = scan_day(base_dir, date)
+    if scan is None:
+        return "no data"
+    stamp, filenames = scan
+
+    keogram_path = os.path.join(output_dir, *date.split('/'), f'keogram-MISS2-{date.replace("/", "")}.png')
+    if not force and os.path.exists(keogram_path):
+        try:
+            with open(stamp_path(output_dir, date)) as f:
+                if json.load(f).get("inputs") == stamp:
+                    return "unchanged"
+        except (OSError, ValueError):
+            pass
+
+    keogram = np.full((num_pixels_y, num_pixels_x, 3), 255, dtype=np.uint8)
+    keogram = add_rgb_columns(keogram, base_dir, date, filenames)
+    save_keogram(keogram, output_dir, date)
+    with open(stamp_path(output_dir, date), "w") as f:
+        json.dump({"inputs": stamp}, f)
+    return "made"
+
+# Batch mode: the keograms of all the dates from start_date to end_date (included), days made in parallel.
+def make_keograms(start_date, end_date, base_dir=rgb_dir_base, output_dir=output_dir, force=False, processes=None):
+    dates = [(start_date + datetime.timedelta(days=i)).strftime("%Y/%m/%d") for i in range((end_date - start_date).days + 1)]
+    results = {"made": 0, "unchanged": 0, "no data": 0}
+    with ProcessPoolExecutor(max_workers=processes) as pool:
+        futures = {pool.submit(make_keogram, date, base_dir, output_dir, force): date for date in dates}
+        for future in as_completed(futures):
+            try:
+                results[future.result()] += 1
+            except Exception as e:
+                print(f"Keogram of {futures[future]} failed: {e}")
+    print(f"{len(dates)} days: {results['made']} keograms made, {results['unchanged']} unchanged, {results['no data']} without data")
+    return results
+
+def parse_date(date_string):
+    return datetime.datetime.strptime(date_string, "%Y/%m/%d").date()
+
 def main():
+    parser = argparse.ArgumentParser(description="Make the keograms of MISS2 for past dates.")
+    parser.add_argument("--start", type=parse_date, help="First date (yyyy/mm/dd), asked interactively if omitted")
+    parser.add_argument("--end", type=parse_date, help="Last date (yyyy/mm/dd), defaults to --start")
+    parser.add_argument("--force", action="store_true", help="Remake the keograms whose columns have not changed")
+    parser.add_argument("--processes", type=int, default=None, help="Days made in parallel (default: one per CPU)")
+    parser.add_argument("--rgb-dir", default=rgb_dir_base, help="Directory of the RGB-columns")
+    parser.add_argument("--output-dir", default=output_dir, help="Directory of the keograms")
+    args = parser.parse_args()
+    if args.start is not None:
+        make_keograms(args.start, args.end or args.start, args.rgb_dir, args.output_dir, args.force, args.processes)
+        return
+
     # Input the date for which you want to generate the keogram
     target_date = input("Enter the date (yyyy/mm/dd) for the keogram: ")
 
@@ -0,0 +1,79 @@
+'''
+Durable checkpoint of the minutes already averaged by average_PNG_maker.py. One small JSON manifest per day, next to the
+averaged images, records for each minute the number of raw frames used and a checksum of the averaged image, so a restart
+resumes instantly instead of re-averaging the whole day, and a raw frame arriving late re-triggers just its own minute.
+
+'''
+
+import os
+import json
+import hashlib
+
+
+# SHA-1 of a file, used to check an output against the checkpoint
+def file_checksum(file_path):
+    with open(file_path, "rb") as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+class ProcessingCheckpoint:
+    # folder: base directory of the outputs (yyyy/mm/dd), the manifests are saved in the day directories
+    def __init__(self, folder, name="averaging-checkpoint"):
+        self.folder = folder
+        self.name = name
+        self.days = {}  # "yyyymmdd" -> {minute_key: {"frames": ..., "averaged": ..., "sha1": ...}}
+
+    def manifest_path(self, day):
+        return os.path.join(self.folder, day[:4], day[4:6], day[6:8], f"{self.name}-{day}.json")
+
+    def _day(self, minute_key):
+        day = minute_key[:8]
+        if day not in self.days:
+            manifest_path = self.manifest_path(day)
+            try:
+                with open(manifest_path) as f:
+                    self.days[day] = json.load(f)
+            except FileNotFoundError:
+                self.days[day] = {}
+            except (OSError, ValueError) as e:
+                print(f"Could not read checkpoint {manifest_path}, the day will be reprocessed: {e}")
+                self.days[day] = {}
+        return self.days[day]
+
+    # Entries of a day ("yyyymmdd") read again from its manifest, e.g. after another process updated it
+    def reload(self, day):
+        self.days.pop(day, None)
+        return self._day(day)
+
+    # Drop the cached entries of the days not in keep_days (a long-running process only needs the recent ones)
+    def forget_days_except(self, keep_days):
+        for day in [day for day in self.days if day not in keep_days]:
+            del self.days[day]
+
+    # True if the minute has been processed with (at least) this number of raw frames
+    def is_done(self, minute_key, frame_count):
+        entry = self._day(minute_key).get(minute_key)
+        return entry is not None and entry["frames"] >= frame_count
+
+    def __contains__(self, minute_key):
+        return minute_key in self._day(minute_key)
+
+    # Record a processed minute and save the manifest of its day (atomically, a crash never leaves a broken manifest)
+    def mark_done(self, minute_key, frame_count, averaged_count, output_path):
+        day_entries = self._day(minute_key)
+        day_entries[minute_key] = {"frames": frame_count, "averaged": averaged_count, "sha1": file_checksum(output_path)}
+
+        manifest_path = self.manifest_path(minute_key[:8])
+        os.makedirs(os.path.dirname(manifest_path), exist_ok=True)
+        temporary_path = manifest_path + ".tmp"
+        with open(temporary_path, "w") as f:
+            json.dump(day_entries, f, separators=(",", ":"), sort_keys=True)
+        os.replace(temporary_path, manifest_path)
+
+    # Check that the output of a processed minute is still the one recorded
+    def verify(self, minute_key, output_path):
+        entry = self._day(minute_key).get(minute_key)
+        try:
+            return entry is not None and file_checksum(output_path) == entry["sha1"]
+        except OSError:
+            return False
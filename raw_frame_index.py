@@ -0,0 +1,66 @@
+'''
+Incremental index of the raw frames for average_PNG_maker.py. Only the directory of the current UTC day (and of the previous
+day just after midnight) is listed, the file names already seen are remembered, and only the new ones are parsed and added
+to the minute -> files map, so each update costs O(new files) instead of walking and parsing the whole archive.
+
+'''
+
+import os
+import re
+import datetime
+from collections import defaultdict
+
+# Raw frame names: MISS2-yyyymmdd-hhmmss[-fff].(png|fits|npy) (milliseconds for sub-second cadences)
+filename_regex = re.compile(r'^.+-(\d{8})-(\d{6})(?:-\d{3})?\.(?:png|fits|npy)$')
+
+
+class RawFrameIndex:
+    # rollover_minutes: how long after midnight (UTC) the previous day is still watched for its last frames
+    def __init__(self, raw_folder, rollover_minutes=5):
+        self.raw_folder = raw_folder
+        self.rollover_minutes = rollover_minutes
+        self.seen_files = {}  # date -> set of file names already indexed
+        self.images_by_minute = defaultdict(list)  # "yyyymmdd-hhmm" -> file paths
+
+    def day_folder(self, date):
+        return os.path.join(self.raw_folder, date.strftime("%Y"), date.strftime("%m"), date.strftime("%d"))
+
+    # Days whose directories may still receive frames
+    def watched_days(self, current_time_utc):
+        today = current_time_utc.date()
+        days = [today]
+        if current_time_utc.hour == 0 and current_time_utc.minute < self.rollover_minutes:
+            days.insert(0, today - datetime.timedelta(days=1))
+        return days
+
+    # Index the new files of the watched days. Returns the minute keys that received new files.
+    def scan(self, current_time_utc):
+        days = self.watched_days(current_time_utc)
+        self._forget_days_except(days)
+
+        updated_minutes = set()
+        for day in days:
+            seen = self.seen_files.setdefault(day, set())
+            try:
+                with os.scandir(self.day_folder(day)) as entries:
+                    new_names = [entry.name for entry in entries if entry.name not in seen and entry.is_file()]
+            except FileNotFoundError:
+                continue
+
+            for filename in new_names:
+                seen.add(filename)
+                match = filename_regex.match(filename)
+                if match:
+                    date_part, time_part = match.groups()
+                    minute_key = date_part + '-' + time_part[:4]
+                    self.images_by_minute[minute_key].append(os.path.join(self.day_folder(day), filename))
+                    updated_minutes.add(minute_key)
+        return updated_minutes
+
+    # Drop the days that are not watched anymore (and their minutes) to keep the index small
+    def _forget_days_except(self, days):
+        kept_prefixes = {day.strftime("%Y%m%d") for day in days}
+        for day in [day for day in self.seen_files if day not in days]:
+            del self.seen_files[day]
+        for minute_key in [key for key in self.images_by_minute if key[:8] not in kept_prefixes]:
+            del self.images_by_minute[minute_key]
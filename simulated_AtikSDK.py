@@ -0,0 +1,198 @@
+'''
+Simulated Atik 414EX with the same method names as AtikSDK.AtikSDKCamera, so that the capture code can be run and timed
+without the vendor SDK or the detector. Exposure and read-out times are simulated, including the overlapped fast mode
+(frame N is read out while frame N+1 is exposing), and the frames are synthetic spectrograms: emission lines at rows
+120/300/405 (2x2 binning) with a drifting auroral arc, shot and read noise, hot pixels and cosmic rays.
+
+'''
+
+import time
+import queue
+import threading
+import numpy as np
+
+# Full-frame size of the Atik 414EX sensor (columns x rows)
+sensor_width = 1391
+sensor_height = 1039
+
+# Centre rows (full-frame, unbinned) of the simulated emission lines and their brightness at the arc peak (counts/s)
+# 427.8 nm, 557.7 nm and 630.0 nm end up on rows 120, 300 and 405 of the 2x2 binned (and flipped) frames
+emission_lines = [(240, 4e4), (600, 2e5), (810, 8e4)]
+line_width = 3.0 # Gaussian sigma of the lines along the rows (full-frame pixels)
+bias_level = 300 # Counts
+read_noise = 8 # Counts (rms)
+hot_pixel_count = 60
+cosmic_ray_rate = 2.0 # Mean number of cosmic ray hits per frame
+arc_period = 600 # Seconds for the auroral arc to drift across the field of view and back
+
+
+class AtikSDKCamera:
+    # readout_time: seconds needed to download one frame from the camera
+    def __init__(self, readout_time=0.2, seed=None):
+        self.readout_time = readout_time
+        self.connected = False
+        self.exposure_duration = 0.05
+        self.binX = 1
+        self.binY = 1
+        self.target_temperature = 0
+        self.temperature = 20.0
+        self.window_heater_power = 0
+        self.continuous_mode = False
+        self.fast_callback = None
+        self.rng = np.random.default_rng(seed)
+        self._scene_binning = None
+        self._fast_threads = []
+        self._fast_stop = threading.Event()
+
+    # Camera connection and information
+
+    def connect(self):
+        self.connected = True
+
+    def disconnect(self):
+        self.stop_exposure()
+        self.connected = False
+
+    def is_connected(self):
+        return self.connected
+
+    def get_device_name(self, device=0):
+        return "Simulated Atik 414EX"
+
+    # Camera settings
+
+    def set_exposure_speed(self, exposure_duration):
+        self.exposure_duration = exposure_duration
+
+    def get_exposure_speed(self):
+        return self.exposure_duration
+
+    def set_binning(self, binX, binY):
+        self.binX = binX
+        self.binY = binY
+
+    def get_binning(self):
+        return self.binX, self.binY
+
+    def set_cooling(self, temperature):
+        self.target_temperature = temperature
+
+    def get_temperature(self):
+        # The sensor slowly approaches the cooling set point
+        self.temperature += 0.1 * (self.target_temperature - self.temperature)
+        return round(self.temperature, 2)
+
+    def cooling_info(self):
+        level = int(np.clip(128 + 10 * (self.temperature - self.target_temperature), 0, 255))
+        return {"flags": 1, "level": level, "min_level": 0, "max_level": 255, "set_point": self.target_temperature}
+
+    def set_window_heater_power(self, power):
+        self.window_heater_power = power
+
+    def get_window_heater_power(self):
+        return self.window_heater_power
+
+    # Image acquisition
+
+    def image_shape(self):
+        return sensor_height // self.binY, sensor_width // self.binX
+
+    # Static parts of the scene, recomputed when the binning changes
+    def _prepare_scene(self):
+        height, width = self.image_shape()
+        rows = (np.arange(height) + 0.5) * self.binY
+        self.line_profiles = np.array([np.exp(-0.5 * ((rows - centre) / line_width) ** 2) for centre, _ in emission_lines])
+        self.line_rates = np.array([rate for _, rate in emission_lines]) * self.binX * self.binY
+        self.columns = np.arange(width)
+
+        # Hot pixels stay at the same place from frame to frame
+        flat_index = self.rng.choice(height * width, size=hot_pixel_count, replace=False)
+        self.hot_pixels = np.unravel_index(flat_index, (height, width))
+        self.hot_pixel_values = self.rng.uniform(5000, 65535, hot_pixel_count)
+        self._scene_binning = (self.binX, self.binY)
+
+    def _synthesise_frame(self):
+        if self._scene_binning != (self.binX, self.binY):
+            self._prepare_scene()
+        height, width = self.image_shape()
+
+        # Auroral arc drifting along the spatial axis (columns) on top of a weak diffuse aurora
+        phase = 2 * np.pi * (time.time() % arc_period) / arc_period
+        arc_centre = width * (0.5 + 0.35 * np.sin(phase))
+        spatial_profile = 0.1 + np.exp(-0.5 * ((self.columns - arc_centre) / (0.05 * width)) ** 2)
+
+        # Expected counts: emission lines (rows) x spatial profile (columns), plus shot and read noise
+        expected = self.line_profiles.T @ (self.line_rates[:, None] * spatial_profile[None, :]) * self.exposure_duration
+        frame = self.rng.poisson(expected).astype(np.float32)
+        frame += self.rng.normal(bias_level, read_noise, (height, width)).astype(np.float32)
+        frame[self.hot_pixels] = self.hot_pixel_values
+
+        # Cosmic ray hits (single bright pixels)
+        hits = self.rng.poisson(cosmic_ray_rate)
+        if hits:
+            frame[self.rng.integers(0, height, hits), self.rng.integers(0, width, hits)] = 65535
+
+        # The detector delivers the frames upside down (capture_Atik.py flips them)
+        return np.clip(frame[::-1], 0, 65535).astype(np.uint16)
+
+    def take_image(self, exposure_duration):
+        self.exposure_duration = exposure_duration
+        time.sleep(exposure_duration + self.readout_time)
+        return self._synthesise_frame()
+
+    def take_image_ms(self, exposure_ms):
+        return self.take_image(exposure_ms / 1000)
+
+    # Overlapped/fast mode
+
+    def continuous_mode_supported(self):
+        return True
+
+    def set_continuous_mode(self, enable):
+        self.continuous_mode = enable
+
+    def set_fast_callback(self, callback):
+        self.fast_callback = callback
+
+    def start_fast_exposure(self, exposure_ms):
+        self.stop_exposure()
+        self.exposure_duration = exposure_ms / 1000
+        self._fast_stop.clear()
+        readout_queue = queue.Queue(maxsize=1)  # The sensor can hold one exposed frame while the previous one is read out
+        self._fast_threads = [
+            threading.Thread(target=self._fast_exposure_loop, args=(exposure_ms / 1000, readout_queue), daemon=True),
+            threading.Thread(target=self._fast_readout_loop, args=(readout_queue,), daemon=True),
+        ]
+        for thread in self._fast_threads:
+            thread.start()
+
+    def _fast_exposure_loop(self, exposure_duration, readout_queue):
+        while not self._fast_stop.is_set():
+            time.sleep(exposure_duration)
+            frame = self._synthesise_frame()
+            # Wait until the read-out of the previous frame has started (frame period = max(exposure, read-out))
+            while not self._fast_stop.is_set():
+                try:
+                    readout_queue.put(frame, timeout=0.1)
+                    break
+                except queue.Full:
+                    continue
+            if not self.continuous_mode:
+                break
+
+    def _fast_readout_loop(self, readout_queue):
+        while not self._fast_stop.is_set():
+            try:
+                frame = readout_queue.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            time.sleep(self.readout_time)
+            if self.fast_callback and not self._fast_stop.is_set():
+                self.fast_callback(frame)
+
+    def stop_exposure(self):
+        self._fast_stop.set()
+        for thread in self._fast_threads:
+            if thread is not threading.current_thread():
+                thread.join()
+        self._fast_threads = []
@@ -0,0 +1,111 @@
+'''
+Wavelength calibration of the MISS2 spectrograms and extraction of any number of spectral bands in one pass over a frame.
+
+spectral_calibration.csv maps each band (emission line or background) to its detector row, in 2x2 binned frames, with its
+half width in rows (band = row - half_width ... row + half_width - 1, the two rows of the column makers for 1). Rows left
+empty are placed with the linear dispersion fitted on the rows that are given; bands falling outside the frame are skipped.
+
+The integration masks are computed once per frame shape and combined into one weight matrix, so a single matrix product
+gives, for every spatial column, the mean of each background band and the mean of each line band minus the background
+interpolated (in wavelength) from the background bands around it.
+
+'''
+
+import os
+import csv
+import numpy as np
+
+calibration_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "spectral_calibration.csv")
+calibration_binning = 2  # The rows of the table are rows of 2x2 binned frames (695x519)
+
+
+# Bands of the calibration table: [{"name", "wavelength", "row", "half_width", "kind"}], rows of calibration_binning frames
+def load_calibration(path=calibration_path):
+    with open(path, newline="") as f:
+        bands = [{"name": entry["name"], "wavelength": float(entry["wavelength_nm"]),
+                  "row": float(entry["row"]) if entry["row"].strip() else None,
+                  "half_width": int(entry["half_width"]), "kind": entry["kind"].strip()} for entry in csv.DictReader(f)]
+
+    # Linear dispersion (row = a * wavelength + b) from the bands whose row is known
+    known = [band for band in bands if band["row"] is not None]
+    if len(known) >= 2:
+        a, b = np.polyfit([band["wavelength"] for band in known], [band["row"] for band in known], 1)
+        for band in bands:
+            if band["row"] is None:
+                band["row"] = a * band["wavelength"] + b
+    return bands
+
+# Detector rows (in frames binned binY vertically) of the given wavelengths, e.g. (630.0, 557.7, 427.8) for the RGB-columns
+def rows_for(wavelengths, bands=None, binY=calibration_binning):
+    bands = load_calibration() if bands is None else bands
+    rows = []
+    for wavelength in wavelengths:
+        band = min(bands, key=lambda band: abs(band["wavelength"] - wavelength))
+        if abs(band["wavelength"] - wavelength) > 0.5:
+            raise ValueError(f"No band at {wavelength} nm in the spectral calibration")
+        rows.append(int(round(band["row"] * calibration_binning / binY)))
+    return tuple(rows)
+
+
+class SpectralExtractor:
+    # bands: from load_calibration(), south_column/north_column: spatial range (None for the whole width),
+    # binY: vertical binning of the frames
+    def __init__(self, bands=None, south_column=None, north_column=None, binY=calibration_binning):
+        self.bands = load_calibration() if bands is None else bands
+        self.column_slice = slice(south_column, north_column)
+        self.binY = binY
+        self._masks = {}  # frame height -> (bands kept, rows used, weight matrix)
+
+    # Integration masks for frames of this height: the bands inside the frame, the rows they use and the
+    # (bands, rows used) weight matrix
+    def masks(self, height):
+        if height in self._masks:
+            return self._masks[height]
+
+        scale = calibration_binning / self.binY
+        kept, means = [], []
+        for band in self.bands:
+            row = int(round(band["row"] * scale))
+            half_width = max(1, int(round(band["half_width"] * scale)))
+            start_row, end_row = row - half_width, row + half_width
+            if start_row < 0 or end_row > height:
+                print(f"Spectral band {band['name']} (rows {start_row}-{end_row - 1}) is outside the frame, skipped")
+                continue
+            mean = np.zeros(height, dtype=np.float32)
+            mean[start_row:end_row] = 1 / (end_row - start_row)
+            kept.append(band)
+            means.append(mean)
+        means = np.array(means).reshape(len(kept), height)
+
+        # Lines: band mean minus the background interpolated between the nearest background bands (or the nearest one)
+        background_index = sorted((i for i, band in enumerate(kept) if band["kind"] == "background"), key=lambda i: kept[i]["wavelength"])
+        weights = means.copy()
+        for i, band in enumerate(kept):
+            if band["kind"] != "line" or not background_index:
+                continue
+            wavelengths = [kept[j]["wavelength"] for j in background_index]
+            position = np.interp(band["wavelength"], wavelengths, np.arange(len(wavelengths)))
+            lower = int(np.floor(position))
+            upper = min(lower + 1, len(wavelengths) - 1)
+            fraction = position - lower
+            weights[i] -= (1 - fraction) * means[background_index[lower]] + fraction * means[background_index[upper]]
+
+        rows_used = np.flatnonzero(np.any(weights != 0, axis=0))
+        self._masks[height] = (kept, rows_used, np.ascontiguousarray(weights[:, rows_used]))
+        return self._masks[height]
+
+    # Names and wavelengths of the bands extracted from frames of this height
+    def channels(self, height):
+        kept = self.masks(height)[0]
+        return [band["name"] for band in kept], np.array([band["wavelength"] for band in kept], dtype=np.float32)
+
+    # Intensity of every band along the spatial axis of one spectrogram: (bands, columns) float32
+    def extract(self, spectro_array):
+        _, rows_used, weights = self.masks(spectro_array.shape[0])
+        return weights @ spectro_array[rows_used, self.column_slice].astype(np.float32)
+
+    # Same for a stack of spectrograms (frames, rows, columns): (frames, bands, columns)
+    def extract_stack(self, spectro_stack):
+        _, rows_used, weights = self.masks(spectro_stack.shape[1])
+        return weights @ spectro_stack[:, rows_used, self.column_slice].astype(np.float32)
+